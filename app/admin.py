@@ -1,45 +1,63 @@
 from __future__ import annotations
 
-from datetime import datetime, timezone
 from typing import Optional
 
-import aiosqlite
-
-from app.config import settings
-from app.db import create_account, get_or_create_owner
+from app.db import insert_account, read_db, transaction
 
 
 SYSTEM_POOL_OWNER_TG_ID = 0  # system owner (not a real telegram user)
 SYSTEM_POOL_KIND = "system"
 SYSTEM_POOL_LABEL = "MAIN POOL"
 
-
-def _utc_now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+# In-memory caches: this process is the only writer of meta/admins,
+# so they are hydrated once and kept in sync by the functions below.
+_owner_loaded = False
+_owner_cache: Optional[int] = None
+_admins_cache: Optional[set[int]] = None
+_main_pool_id: Optional[int] = None
+# Bumped after every committed owner/admin write; a load that overlapped one retries.
+_access_generation = 0
 
 
-async def _ensure_meta_table() -> None:
-    async with aiosqlite.connect(settings.DB_PATH) as db:
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS meta (
-                k TEXT PRIMARY KEY,
-                v TEXT NOT NULL
-            );
-            """
-        )
-        await db.commit()
+async def _load_access() -> None:
+    """
+    Cold path for is_owner/is_admin: owner id + active admins in ONE query.
+    """
+    global _owner_loaded, _owner_cache, _admins_cache
+    while True:
+        generation = _access_generation
+        async with read_db() as db:
+            cur = await db.execute(
+                """
+                SELECT 'owner', v FROM meta WHERE k = 'OWNER_TG_ID'
+                UNION ALL
+                SELECT 'admin', tg_user_id FROM admins WHERE is_active = 1;
+                """
+            )
+            rows = await cur.fetchall()
+        if generation == _access_generation:
+            break
+
+    owner_id = None
+    admins: set[int] = set()
+    for kind, value in rows:
+        if kind == "owner":
+            try:
+                owner_id = int(value)  # int() strips whitespace itself
+            except (TypeError, ValueError):
+                owner_id = None
+        else:
+            admins.add(int(value))
+
+    _owner_cache = owner_id
+    _owner_loaded = True
+    _admins_cache = admins
 
 
 async def get_owner_tg_id() -> Optional[int]:
-    await _ensure_meta_table()
-    async with aiosqlite.connect(settings.DB_PATH) as db:
-        cur = await db.execute("SELECT v FROM meta WHERE k='OWNER_TG_ID' LIMIT 1;")
-        row = await cur.fetchone()
-        if not row:
-            return None
-        v = str(row[0]).strip()
-        return int(v) if v.isdigit() else None
+    if not _owner_loaded:
+        await _load_access()
+    return _owner_cache
 
 
 async def ensure_owner_seed(owner_tg_id: int) -> None:
@@ -48,17 +66,19 @@ async def ensure_owner_seed(owner_tg_id: int) -> None:
     - Can ONLY be set once.
     - If OWNER_TG_ID already exists, this function raises.
     """
-    await _ensure_meta_table()
+    global _owner_loaded, _owner_cache, _access_generation
     existing = await get_owner_tg_id()
     if existing is not None:
         raise PermissionError("OWNER already set and locked")
 
-    async with aiosqlite.connect(settings.DB_PATH) as db:
+    async with transaction() as db:
         await db.execute(
             "INSERT INTO meta(k, v) VALUES('OWNER_TG_ID', ?);",
             (str(owner_tg_id),),
         )
-        await db.commit()
+    _access_generation += 1
+    _owner_cache = owner_tg_id
+    _owner_loaded = True
 
 
 async def is_owner(tg_user_id: int) -> bool:
@@ -72,46 +92,50 @@ async def is_admin(tg_user_id: int) -> bool:
     """
     if await is_owner(tg_user_id):
         return True
+    return tg_user_id in await _get_admins()
 
-    async with aiosqlite.connect(settings.DB_PATH) as db:
-        cur = await db.execute(
-            "SELECT 1 FROM admins WHERE tg_user_id = ? AND is_active = 1 LIMIT 1;",
-            (tg_user_id,),
-        )
-        row = await cur.fetchone()
-        return bool(row)
+
+async def _get_admins() -> set[int]:
+    if _admins_cache is None:
+        await _load_access()
+    return _admins_cache
 
 
 async def add_admin(tg_user_id: int) -> None:
-    async with aiosqlite.connect(settings.DB_PATH) as db:
+    global _access_generation
+    async with transaction() as db:
         await db.execute(
             """
             INSERT INTO admins(tg_user_id, is_active, created_at)
-            VALUES (?, 1, ?)
+            VALUES (?, 1, strftime('%Y-%m-%dT%H:%M:%S+00:00', 'now'))
             ON CONFLICT(tg_user_id) DO UPDATE SET is_active=1;
             """,
-            (tg_user_id, _utc_now_iso()),
+            (tg_user_id,),
         )
-        await db.commit()
+    _access_generation += 1
+    if _admins_cache is not None:
+        _admins_cache.add(tg_user_id)
 
 
 async def remove_admin(tg_user_id: int) -> None:
-    async with aiosqlite.connect(settings.DB_PATH) as db:
+    global _access_generation
+    async with transaction() as db:
         await db.execute(
             "UPDATE admins SET is_active = 0 WHERE tg_user_id = ?;",
             (tg_user_id,),
         )
-        await db.commit()
+    _access_generation += 1
+    if _admins_cache is not None:
+        _admins_cache.discard(tg_user_id)
 
 
 async def ensure_main_pool_account() -> int:
     """
     Creates (or returns) MAIN POOL as a system account.
     Returns account_id of the pool.
+    Lookup and creation share one transaction, so concurrent callers can't both create it.
     """
-    await get_or_create_owner(SYSTEM_POOL_OWNER_TG_ID)
-
-    async with aiosqlite.connect(settings.DB_PATH) as db:
+    async with transaction() as db:
         cur = await db.execute(
             """
             SELECT id FROM accounts
@@ -127,14 +151,20 @@ async def ensure_main_pool_account() -> int:
         if row:
             return int(row[0])
 
-    pool_id = await create_account(
-        tg_user_id=SYSTEM_POOL_OWNER_TG_ID,
-        kind=SYSTEM_POOL_KIND,
-        label=SYSTEM_POOL_LABEL,
-        set_active=True,
-    )
-    return int(pool_id)
+        return await insert_account(
+            db,
+            tg_user_id=SYSTEM_POOL_OWNER_TG_ID,
+            kind=SYSTEM_POOL_KIND,
+            label=SYSTEM_POOL_LABEL,
+            set_active=True,
+        )
 
 
 async def get_main_pool_account_id() -> int:
-    return await ensure_main_pool_account()
+    """
+    MAIN POOL id, resolved once (seeded at startup by main()) then served from memory.
+    """
+    global _main_pool_id
+    if _main_pool_id is None:
+        _main_pool_id = await ensure_main_pool_account()
+    return _main_pool_id
@@ -1,21 +1,93 @@
 from __future__ import annotations
 
+import asyncio
+import json
+import time
 from dataclasses import dataclass
-from datetime import datetime, timezone, timedelta
-from typing import Optional, List, Tuple
+from typing import Iterable, Optional, List, Tuple
 
 import aiosqlite
 
-from app.config import settings
-from app.receipt.generator import generate_receipt
+from app.db import Account, read_db, transaction
+from app.receipt.generator import new_receipt_no, render_receipt
 
 
 # System account IDs will be reserved later via DB seed.
 # For now we use constant logical keys.
 SYSTEM_POOL_KEY = "__MAIN_POOL__"
 
+HISTORY_WINDOW_SECONDS = 7 * 24 * 3600
 
-@dataclass(frozen=True)
+_SQL_BALANCE = "SELECT balance FROM accounts WHERE id = ? LIMIT 1;"
+
+# /balance: the user's active account and its balance in one statement.
+_SQL_ACTIVE_BALANCE = """
+    SELECT a.id, a.owner_tg_id, a.kind, a.label, a.is_active, a.created_at, a.balance
+    FROM owners o
+    JOIN accounts a ON a.id = o.active_account_id
+    WHERE o.tg_user_id = ?
+    LIMIT 1;
+"""
+
+# OR across two columns defeats the indexes: one index-only range per side (self-transfers
+# from the "from" side only), full rows fetched for the final page.
+_SQL_LAST_TX = """
+    SELECT t.receipt_no, t.ts_utc, t.from_account_id, t.to_account_id, t.amount, t.status,
+           COALESCE(t.description,''), t.created_by_tg_id, t.forced
+    FROM (
+        SELECT * FROM (
+            SELECT id, ts_epoch FROM transactions
+            WHERE from_account_id = :acc AND ts_epoch >= :cutoff
+            ORDER BY ts_epoch DESC
+            LIMIT :limit
+        )
+        UNION ALL
+        SELECT * FROM (
+            SELECT id, ts_epoch FROM transactions
+            WHERE to_account_id = :acc AND ts_epoch >= :cutoff
+              AND from_account_id IS NOT :acc
+            ORDER BY ts_epoch DESC
+            LIMIT :limit
+        )
+    ) AS k
+    JOIN transactions AS t ON t.id = k.id
+    ORDER BY k.ts_epoch DESC
+    LIMIT :limit;
+"""
+
+# Sender + receiver rows in one lookup.
+_SQL_TRANSFER_ACCOUNTS = "SELECT id, label, kind, owner_tg_id FROM accounts WHERE id IN (?, ?) AND is_active = 1;"
+
+# Every active account a batch touches (ids bound as one JSON array).
+_SQL_ACTIVE_IDS = "SELECT id FROM accounts WHERE id IN (SELECT value FROM json_each(?)) AND is_active = 1;"
+
+# Debit + credit in one statement with a DB-side funds check.
+# Touches 2 rows (1 for a self-transfer) unless funds are short.
+_SQL_APPLY_TRANSFER = """
+    UPDATE accounts
+    SET balance = balance + CASE
+        WHEN :from_id = :to_id THEN 0
+        WHEN id = :from_id THEN -:amount
+        ELSE :amount
+    END
+    WHERE id IN (:from_id, :to_id)
+      AND is_active = 1
+      AND (id != :from_id OR :forced OR balance >= :amount);
+"""
+
+# ts_utc is derived from the bound epoch (?2) inside SQLite.
+_SQL_INSERT_TX = """
+    INSERT INTO transactions (
+        receipt_no, ts_utc, ts_epoch,
+        from_account_id, to_account_id,
+        amount, status, description,
+        created_by_tg_id, forced
+    )
+    VALUES (?1, strftime('%Y-%m-%dT%H:%M:%S+00:00', ?2, 'unixepoch'), ?2, ?3, ?4, ?5, ?6, ?7, ?8, ?9);
+"""
+
+
+@dataclass(frozen=True, slots=True)
 class TxRow:
     receipt_no: str
     ts_utc: str
@@ -28,47 +100,33 @@ class TxRow:
     forced: int
 
 
-def _utc_now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat(timespec="seconds")
-
-
 async def get_balance(account_id: int) -> int:
     """
-    Ledger-based balance:
-    IN  = sum(amount) where to_account_id = account_id and status in SUCCESS/FORCED
-    OUT = sum(amount) where from_account_id = account_id and status in SUCCESS/FORCED
+    Materialized balance (accounts.balance), kept in sync with the ledger by transfer().
     """
-    async with aiosqlite.connect(settings.DB_PATH) as db:
-        cur = await db.execute(
-            """
-            SELECT
-              COALESCE(SUM(CASE WHEN to_account_id = ? THEN amount ELSE 0 END), 0) -
-              COALESCE(SUM(CASE WHEN from_account_id = ? THEN amount ELSE 0 END), 0)
-            FROM transactions
-            WHERE status IN ('SUCCESS', 'FORCED')
-              AND (from_account_id = ? OR to_account_id = ?);
-            """,
-            (account_id, account_id, account_id, account_id),
-        )
+    async with read_db() as db:
+        cur = await db.execute(_SQL_BALANCE, (account_id,))
         row = await cur.fetchone()
-        return int(row[0] or 0)
+    return int(row[0] or 0) if row else 0
+
+
+async def get_active_balance(tg_user_id: int) -> Optional[Tuple[Account, int]]:
+    """
+    (active account, balance) with one pooled read instead of get_active_account()
+    + get_balance(): one connection borrow, one statement. None if no active account.
+    """
+    async with read_db() as db:
+        cur = await db.execute(_SQL_ACTIVE_BALANCE, (tg_user_id,))
+        r = await cur.fetchone()
+    if not r:
+        return None
+    return Account(*r[:6]), int(r[6] or 0)
 
 
 async def get_last_7_days(account_id: int, limit: int = 50) -> List[TxRow]:
-    cutoff = (datetime.now(timezone.utc) - timedelta(days=7)).isoformat(timespec="seconds")
-    async with aiosqlite.connect(settings.DB_PATH) as db:
-        cur = await db.execute(
-            """
-            SELECT receipt_no, ts_utc, from_account_id, to_account_id, amount, status,
-                   COALESCE(description,''), created_by_tg_id, forced
-            FROM transactions
-            WHERE (from_account_id = ? OR to_account_id = ?)
-              AND ts_utc >= ?
-            ORDER BY ts_utc DESC
-            LIMIT ?;
-            """,
-            (account_id, account_id, cutoff, limit),
-        )
+    cutoff = int(time.time()) - HISTORY_WINDOW_SECONDS
+    async with read_db() as db:
+        cur = await db.execute(_SQL_LAST_TX, {"acc": account_id, "cutoff": cutoff, "limit": limit})
         rows = await cur.fetchall()
 
     return [
@@ -87,6 +145,44 @@ async def get_last_7_days(account_id: int, limit: int = 50) -> List[TxRow]:
     ]
 
 
+async def _apply_transfer(
+    db: aiosqlite.Connection,
+    from_account_id: int,
+    to_account_id: int,
+    amount: int,
+    forced: bool,
+) -> Tuple[tuple, tuple]:
+    """
+    Checks both accounts and moves the funds inside the caller's transaction().
+    Returns the (id, label, kind, owner_tg_id) rows of sender and receiver.
+    """
+    # Ensure accounts exist & active
+    cur = await db.execute(_SQL_TRANSFER_ACCOUNTS, (from_account_id, to_account_id))
+    rows = {int(r[0]): r for r in await cur.fetchall()}
+    from_row = rows.get(from_account_id)
+    if not from_row:
+        raise ValueError("sender account not found")
+
+    to_row = rows.get(to_account_id)
+    if not to_row:
+        raise ValueError("receiver account not found")
+
+    # Move funds (balance check unless forced)
+    cur = await db.execute(
+        _SQL_APPLY_TRANSFER,
+        {
+            "from_id": from_account_id,
+            "to_id": to_account_id,
+            "amount": amount,
+            "forced": 1 if forced else 0,
+        },
+    )
+    if cur.rowcount != len(rows):
+        raise ValueError("insufficient funds")
+
+    return from_row, to_row
+
+
 async def transfer(
     *,
     from_account_id: int,
@@ -95,12 +191,13 @@ async def transfer(
     description: str,
     created_by_tg_id: int,
     forced: bool = False,
-) -> tuple[str, bytes]:
+) -> tuple[str, bytes, int]:
     """
     Atomic-ish transfer with balance check (unless forced).
-    Produces: (receipt_no, receipt_png_bytes)
+    Produces: (receipt_no, receipt_image_bytes, receiver_owner_tg_id)
 
-    NOTE: SQLite concurrency is OK for small bots; we use BEGIN IMMEDIATE to lock writes.
+    NOTE: SQLite concurrency is OK for small bots; transaction() takes BEGIN IMMEDIATE
+    on the shared connection and rolls back if anything below raises.
     """
     if amount <= 0:
         raise ValueError("amount must be > 0")
@@ -109,76 +206,19 @@ async def transfer(
     if not description:
         raise ValueError("description is required")
 
-    async with aiosqlite.connect(settings.DB_PATH) as db:
-        await db.execute("PRAGMA foreign_keys=ON;")
-        await db.execute("BEGIN IMMEDIATE;")  # lock for consistent balance + insert
-
-        # Ensure accounts exist & active
-        cur = await db.execute(
-            "SELECT id, label, kind FROM accounts WHERE id = ? AND is_active = 1 LIMIT 1;",
-            (from_account_id,),
-        )
-        from_row = await cur.fetchone()
-        if not from_row:
-            await db.execute("ROLLBACK;")
-            raise ValueError("sender account not found")
-
-        cur = await db.execute(
-            "SELECT id, label, kind FROM accounts WHERE id = ? AND is_active = 1 LIMIT 1;",
-            (to_account_id,),
-        )
-        to_row = await cur.fetchone()
-        if not to_row:
-            await db.execute("ROLLBACK;")
-            raise ValueError("receiver account not found")
+    status = "FORCED" if forced else "SUCCESS"
+    receipt_no = new_receipt_no()
 
-        # Balance check (ledger-based) unless forced
-        if not forced:
-            cur = await db.execute(
-                """
-                SELECT
-                  COALESCE(SUM(CASE WHEN to_account_id = ? THEN amount ELSE 0 END), 0) -
-                  COALESCE(SUM(CASE WHEN from_account_id = ? THEN amount ELSE 0 END), 0)
-                FROM transactions
-                WHERE status IN ('SUCCESS', 'FORCED')
-                  AND (from_account_id = ? OR to_account_id = ?);
-                """,
-                (from_account_id, from_account_id, from_account_id, from_account_id),
-            )
-            bal_row = await cur.fetchone()
-            balance = int(bal_row[0] or 0)
-            if balance < amount:
-                await db.execute("ROLLBACK;")
-                raise ValueError("insufficient funds")
-
-        # Make receipt (needs display strings)
-        sender_display = f"{from_row[1]} ({from_row[2]}) [ID:{from_account_id}]"
-        receiver_display = f"{to_row[1]} ({to_row[2]}) [ID:{to_account_id}]"
-
-        status = "FORCED" if forced else "SUCCESS"
-
-        receipt_no, image = generate_receipt(
-            sender_account=sender_display,
-            receiver_account=receiver_display,
-            amount=amount,
-            status=status,
-            description=description,
-        )
+    # Only DB work runs under the write lock; the receipt is drawn after COMMIT.
+    async with transaction() as db:  # lock for consistent balance + insert
+        from_row, to_row = await _apply_transfer(db, from_account_id, to_account_id, amount, forced)
 
         # Insert ledger row
         await db.execute(
-            """
-            INSERT INTO transactions (
-                receipt_no, ts_utc,
-                from_account_id, to_account_id,
-                amount, status, description,
-                created_by_tg_id, forced
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
-            """,
+            _SQL_INSERT_TX,
             (
                 receipt_no,
-                _utc_now_iso(),
+                int(time.time()),
                 from_account_id,
                 to_account_id,
                 amount,
@@ -189,11 +229,87 @@ async def transfer(
             ),
         )
 
-        await db.commit()
+    # Make receipt (needs display strings)
+    sender_display = f"{from_row[1]} ({from_row[2]}) [ID:{from_account_id}]"
+    receiver_display = f"{to_row[1]} ({to_row[2]}) [ID:{to_account_id}]"
+
+    # Draw + encode outside the transaction, off the event loop
+    image = await asyncio.to_thread(
+        render_receipt,
+        sender_account=sender_display,
+        receiver_account=receiver_display,
+        amount=amount,
+        status=status,
+        description=description,
+        receipt_no=receipt_no,
+    )
+    return receipt_no, image, int(to_row[3])
+
+
+async def book_transfers(
+    db: aiosqlite.Connection,
+    transfers: Iterable[Tuple[int, int, int, str]],
+    *,
+    created_by_tg_id: int,
+    forced: bool = False,
+) -> List[str]:
+    """
+    Books (from_account_id, to_account_id, amount, description) items inside the
+    caller's transaction(); no receipt images are rendered. Any failing item raises,
+    so the caller's transaction rolls back. Returns receipt numbers in input order.
+    """
+    status = "FORCED" if forced else "SUCCESS"
+    ts_epoch = int(time.time())
+    items = []
+    ledger: List[tuple] = []
+
+    for from_account_id, to_account_id, amount, description in transfers:
+        if amount <= 0:
+            raise ValueError("amount must be > 0")
+        description = (description or "").strip()
+        if not description:
+            raise ValueError("description is required")
+
+        items.append((from_account_id, to_account_id, amount))
+        ledger.append(
+            (
+                new_receipt_no(),
+                ts_epoch,
+                from_account_id,
+                to_account_id,
+                amount,
+                status,
+                description,
+                created_by_tg_id,
+                1 if forced else 0,
+            )
+        )
+
+    if not items:
+        return []
+
+    # one existence check + one executemany per write for the whole batch
+    cur = await db.execute(
+        _SQL_ACTIVE_IDS,
+        (json.dumps(sorted({acc for f, t, _ in items for acc in (f, t)})),),
+    )
+    active = {int(r[0]) for r in await cur.fetchall()}
+    for from_account_id, to_account_id, _amount in items:
+        if from_account_id not in active:
+            raise ValueError("sender account not found")
+        if to_account_id not in active:
+            raise ValueError("receiver account not found")
+
+    # rowcount is summed over the batch: an item that was short on funds shows up here
+    cur = await db.executemany(
+        _SQL_APPLY_TRANSFER,
+        [
+            {"from_id": f, "to_id": t, "amount": amount, "forced": 1 if forced else 0}
+            for f, t, amount in items
+        ],
+    )
+    if cur.rowcount != sum(1 if f == t else 2 for f, t, _ in items):
+        raise ValueError("insufficient funds")
 
-    # Convert image to PNG bytes (outside transaction)
-    from io import BytesIO
-    bio = BytesIO()
-    bio.name = f"receipt_{receipt_no}.png"
-    image.save(bio, format="PNG")
-    return receipt_no, bio.getvalue()
+    await db.executemany(_SQL_INSERT_TX, ledger)
+    return [row[0] for row in ledger]
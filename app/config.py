@@ -1,21 +1,20 @@
-from pydantic_settings import BaseSettings
-from pydantic import Field
+import logging
+import os
 
+from app.settings import Settings
 
-class Settings(BaseSettings):
-    BOT_TOKEN: str = Field(..., description="Telegram Bot Token")
+logger = logging.getLogger(__name__)
 
-    # Database
-    DB_PATH: str = "data/bank.db"
-
-    # Receipt
-    RECEIPT_FONT: str = "assets/font.ttf"
-    RECEIPT_WIDTH: int = 900
-    RECEIPT_HEIGHT: int = 500
-
-    class Config:
-        env_file = ".env"
-        env_file_encoding = "utf-8"
-
-
-settings = Settings()
+try:
+    # Deploy-time snapshot written by scripts/freeze_env.py.
+    from app._env_frozen import SETTINGS as _FROZEN
+except ImportError:
+    settings = Settings()
+else:
+    # Real environment variables still win over the snapshot (e.g. a rotated BOT_TOKEN).
+    _overrides = {k: os.environ[k] for k in Settings.model_fields if k in os.environ}
+    settings = Settings.model_validate({**_FROZEN, **_overrides})
+    logger.warning(
+        "Using frozen settings from app/_env_frozen.py (.env ignored); overridden by environment: %s",
+        ", ".join(sorted(_overrides)) or "none",
+    )
@@ -1,19 +1,17 @@
 from __future__ import annotations
 
+import asyncio
 import os
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
-from datetime import datetime, timezone
-from typing import Optional, List, Tuple
+from pathlib import Path
+from typing import AsyncIterator, Optional, List, Tuple
 
 import aiosqlite
 
 from app.config import settings
 
 
-def _utc_now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat(timespec="seconds")
-
-
 async def _ensure_data_dir():
     db_path = settings.DB_PATH
     parent = os.path.dirname(db_path)
@@ -21,7 +19,236 @@ async def _ensure_data_dir():
         os.makedirs(parent, exist_ok=True)
 
 
-@dataclass(frozen=True)
+# Shared writer connection (autocommit); writers serialize on _write_lock.
+_db: Optional[aiosqlite.Connection] = None
+_open_lock = asyncio.Lock()
+_write_lock = asyncio.Lock()
+
+# Shared by the writer and the readers: page cache, in-memory temp B-trees, mmap reads,
+# and a bounded wait on locks held by other processes.
+_PRAGMA_TUNING = (
+    "PRAGMA cache_size=-20000;",
+    "PRAGMA temp_store=MEMORY;",
+    "PRAGMA mmap_size=268435456;",
+    "PRAGMA busy_timeout=5000;",
+)
+
+# Read-only connections for SELECT paths; under WAL they never block the writer.
+_READ_POOL_SIZE = min(os.cpu_count() or 2, 8)
+_read_pool: Optional[asyncio.Queue[aiosqlite.Connection]] = None
+
+
+async def get_db() -> aiosqlite.Connection:
+    """
+    Returns the shared connection, opening it (and applying PRAGMAs) on first use.
+    """
+    global _db
+    if _db is not None:
+        return _db
+
+    async with _open_lock:
+        if _db is None:
+            await _ensure_data_dir()
+            # compiled statements are cached per connection by SQL text: keep hot SQL constant
+            conn = await aiosqlite.connect(settings.DB_PATH, isolation_level=None, cached_statements=256)
+            await conn.execute("PRAGMA journal_mode=WAL;")
+            # NORMAL is safe under WAL (power loss may drop the last commits, never corrupts)
+            await conn.execute("PRAGMA synchronous=NORMAL;")
+            await conn.execute("PRAGMA foreign_keys=ON;")
+            for pragma in _PRAGMA_TUNING:
+                await conn.execute(pragma)
+            await conn.execute("PRAGMA wal_autocheckpoint=1000;")
+            _db = conn
+    return _db
+
+
+async def _get_read_pool() -> asyncio.Queue[aiosqlite.Connection]:
+    """
+    Opens the read-only connections on first use (after init_db has created the file).
+    """
+    global _read_pool
+    if _read_pool is not None:
+        return _read_pool
+
+    await get_db()  # keeps the -wal/-shm files around for the read-only openers
+    async with _open_lock:
+        if _read_pool is None:
+            uri = Path(settings.DB_PATH).resolve().as_uri() + "?mode=ro"
+            pool: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+            for _ in range(_READ_POOL_SIZE):
+                conn = await aiosqlite.connect(uri, uri=True, isolation_level=None, cached_statements=256)
+                await conn.execute("PRAGMA query_only=1;")
+                for pragma in _PRAGMA_TUNING:
+                    await conn.execute(pragma)
+                pool.put_nowait(conn)
+            _read_pool = pool
+    return _read_pool
+
+
+@asynccontextmanager
+async def read_db() -> AsyncIterator[aiosqlite.Connection]:
+    """
+    Borrows a read-only connection; sees only committed data.
+    """
+    pool = await _get_read_pool()
+    conn = await pool.get()
+    try:
+        yield conn
+    finally:
+        pool.put_nowait(conn)
+
+
+async def close_db() -> None:
+    global _db, _read_pool
+    if _read_pool is not None:
+        while not _read_pool.empty():
+            await _read_pool.get_nowait().close()
+        _read_pool = None
+    if _db is not None:
+        await _db.close()
+        _db = None
+
+
+@asynccontextmanager
+async def transaction() -> AsyncIterator[aiosqlite.Connection]:
+    """
+    BEGIN IMMEDIATE ... COMMIT on the shared connection; rolls back on any exception.
+    """
+    db = await get_db()
+    async with _write_lock:
+        await db.execute("BEGIN IMMEDIATE;")
+        try:
+            yield db
+        except BaseException:
+            await db.execute("ROLLBACK;")
+            raise
+        await db.execute("COMMIT;")
+
+
+async def write_fetchall(sql: str, params=()) -> list:
+    """
+    One write statement in autocommit mode under the write lock; returns its rows (RETURNING).
+    A lone statement takes SQLite's write lock directly, so it needs no BEGIN IMMEDIATE.
+    """
+    db = await get_db()
+    async with _write_lock:
+        return list(await db.execute_fetchall(sql, params))
+
+
+# Whole schema in one executescript; every statement is idempotent.
+_SCHEMA_SQL = """
+BEGIN IMMEDIATE;
+
+-- Owners: 1 telegram user -> can own multiple accounts
+CREATE TABLE IF NOT EXISTS owners (
+    tg_user_id INTEGER PRIMARY KEY,
+    active_account_id INTEGER,
+    created_at TEXT NOT NULL
+);
+
+-- Accounts: multi per owner
+CREATE TABLE IF NOT EXISTS accounts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner_tg_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,           -- personal / business / ...
+    label TEXT NOT NULL,          -- user friendly label
+    is_active INTEGER NOT NULL DEFAULT 1,
+    created_at TEXT NOT NULL,
+    balance INTEGER NOT NULL DEFAULT 0, -- materialized from ledger
+
+    FOREIGN KEY (owner_tg_id) REFERENCES owners(tg_user_id) ON DELETE CASCADE
+);
+
+-- owner-only lookups use the leftmost prefix of idx_accounts_owner_kind
+DROP INDEX IF EXISTS idx_accounts_owner;
+CREATE INDEX IF NOT EXISTS idx_accounts_owner_kind ON accounts(owner_tg_id, kind);
+
+-- Key/value settings (OWNER_TG_ID, ...)
+CREATE TABLE IF NOT EXISTS meta (
+    k TEXT PRIMARY KEY,
+    v TEXT NOT NULL
+);
+
+-- Admin roles (owner/admin control will be added later)
+CREATE TABLE IF NOT EXISTS admins (
+    tg_user_id INTEGER PRIMARY KEY,
+    is_active INTEGER NOT NULL DEFAULT 1,
+    created_at TEXT NOT NULL
+);
+
+-- Transactions ledger (receipt_no is numeric string, unique)
+-- from_account_id/to_account_id nullable to support pool/system transactions later.
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    receipt_no TEXT NOT NULL UNIQUE,
+    ts_utc TEXT NOT NULL,
+    ts_epoch INTEGER,               -- unix seconds, same instant as ts_utc
+
+    from_account_id INTEGER,
+    to_account_id INTEGER,
+
+    amount INTEGER NOT NULL CHECK(amount > 0),
+    status TEXT NOT NULL,           -- PENDING / SUCCESS / FAILED / FORCED
+    description TEXT,
+
+    created_by_tg_id INTEGER NOT NULL, -- who initiated (user/admin)
+    forced INTEGER NOT NULL DEFAULT 0,
+
+    FOREIGN KEY (from_account_id) REFERENCES accounts(id) ON DELETE SET NULL,
+    FOREIGN KEY (to_account_id) REFERENCES accounts(id) ON DELETE SET NULL
+);
+
+-- Time filters use the integer column; the old TEXT index is dropped.
+DROP INDEX IF EXISTS idx_tx_ts;
+CREATE INDEX IF NOT EXISTS idx_tx_ts_epoch ON transactions(ts_epoch);
+
+-- Per-account history: (account, time) composites replace the single-column indexes;
+-- the "to" side also carries from_account_id, so both history arms are index-only.
+DROP INDEX IF EXISTS idx_tx_from;
+DROP INDEX IF EXISTS idx_tx_to;
+DROP INDEX IF EXISTS idx_tx_to_ts;
+CREATE INDEX IF NOT EXISTS idx_tx_from_ts ON transactions(from_account_id, ts_epoch DESC);
+CREATE INDEX IF NOT EXISTS idx_tx_to_cover ON transactions(to_account_id, ts_epoch DESC, from_account_id);
+
+COMMIT;
+"""
+
+
+# created_at is stamped by SQLite (ISO-8601 UTC, second precision).
+_SQL_UPSERT_OWNER = """
+    INSERT INTO owners(tg_user_id, active_account_id, created_at)
+    VALUES (?, NULL, strftime('%Y-%m-%dT%H:%M:%S+00:00', 'now'))
+    ON CONFLICT(tg_user_id) DO NOTHING;
+"""
+_SQL_INSERT_ACCOUNT = """
+    INSERT INTO accounts(owner_tg_id, kind, label, is_active, created_at)
+    VALUES (?, ?, ?, 1, strftime('%Y-%m-%dT%H:%M:%S+00:00', 'now'))
+    RETURNING id;
+"""
+_SQL_SET_ACTIVE = "UPDATE owners SET active_account_id = ? WHERE tg_user_id = ?;"
+_SQL_ACTIVE_ID = "SELECT active_account_id FROM owners WHERE tg_user_id = ?;"
+_SQL_LIST_ACCOUNTS = """
+    SELECT id, owner_tg_id, kind, label, is_active, created_at
+    FROM accounts
+    WHERE owner_tg_id = ?
+    ORDER BY id ASC;
+"""
+# Active account via owners.active_account_id -> accounts PK: one row, one lookup.
+_SQL_ACTIVE_ACCOUNT = """
+    SELECT a.id, a.owner_tg_id, a.kind, a.label, a.is_active, a.created_at
+    FROM owners o
+    JOIN accounts a ON a.id = o.active_account_id
+    WHERE o.tg_user_id = ?
+    LIMIT 1;
+"""
+_SQL_OWNED_ACCOUNT = """
+    SELECT id, owner_tg_id, kind, label, is_active, created_at FROM accounts
+    WHERE id = ? AND owner_tg_id = ? AND is_active = 1
+    LIMIT 1;
+"""
+
+
+@dataclass(frozen=True, slots=True)
 class Account:
     id: int
     owner_tg_id: int
@@ -34,100 +261,63 @@ class Account:
 async def init_db() -> None:
     """
     Creates DB schema if not exists.
-    Source of truth is ledger table (transactions). Balances can be computed later.
-    """
-    await _ensure_data_dir()
-
-    async with aiosqlite.connect(settings.DB_PATH) as db:
-        await db.execute("PRAGMA journal_mode=WAL;")
-        await db.execute("PRAGMA foreign_keys=ON;")
-
-        # Owners: 1 telegram user -> can own multiple accounts
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS owners (
-                tg_user_id INTEGER PRIMARY KEY,
-                active_account_id INTEGER,
-                created_at TEXT NOT NULL
-            );
-            """
-        )
-
-        # Accounts: multi per owner
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS accounts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                owner_tg_id INTEGER NOT NULL,
-                kind TEXT NOT NULL,           -- personal / business / ...
-                label TEXT NOT NULL,          -- user friendly label
-                is_active INTEGER NOT NULL DEFAULT 1,
-                created_at TEXT NOT NULL,
-
-                FOREIGN KEY (owner_tg_id) REFERENCES owners(tg_user_id) ON DELETE CASCADE
-            );
-            """
-        )
-
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_accounts_owner ON accounts(owner_tg_id);")
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_accounts_owner_kind ON accounts(owner_tg_id, kind);")
-
-        # Admin roles (owner/admin control will be added later)
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS admins (
-                tg_user_id INTEGER PRIMARY KEY,
-                is_active INTEGER NOT NULL DEFAULT 1,
-                created_at TEXT NOT NULL
-            );
-            """
-        )
-
-        # Transactions ledger (receipt_no is numeric string, unique)
-        # from_account_id/to_account_id nullable to support pool/system transactions later.
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                receipt_no TEXT NOT NULL UNIQUE,
-                ts_utc TEXT NOT NULL,
-
-                from_account_id INTEGER,
-                to_account_id INTEGER,
-
-                amount INTEGER NOT NULL CHECK(amount > 0),
-                status TEXT NOT NULL,           -- PENDING / SUCCESS / FAILED / FORCED
-                description TEXT,
-
-                created_by_tg_id INTEGER NOT NULL, -- who initiated (user/admin)
-                forced INTEGER NOT NULL DEFAULT 0,
-
-                FOREIGN KEY (from_account_id) REFERENCES accounts(id) ON DELETE SET NULL,
-                FOREIGN KEY (to_account_id) REFERENCES accounts(id) ON DELETE SET NULL
-            );
-            """
-        )
-
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_tx_ts ON transactions(ts_utc);")
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_tx_from ON transactions(from_account_id);")
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_tx_to ON transactions(to_account_id);")
-
-        await db.commit()
-
-
-async def get_or_create_owner(tg_user_id: int) -> None:
-    async with aiosqlite.connect(settings.DB_PATH) as db:
-        await db.execute("PRAGMA foreign_keys=ON;")
-        cur = await db.execute("SELECT tg_user_id FROM owners WHERE tg_user_id = ?;", (tg_user_id,))
-        row = await cur.fetchone()
-        if row:
-            return
+    Source of truth is ledger table (transactions); accounts.balance is a
+    materialized running total maintained by banking.transfer.
+    """
+    # Column migrations first: the schema script indexes the columns they add.
+    async with transaction() as db:
+        await _migrate_accounts_balance(db)
+        await _migrate_tx_epoch(db)
+
+    # executescript() commits first, so the script carries its own BEGIN ... COMMIT
+    async with _write_lock:
+        try:
+            await db.executescript(_SCHEMA_SQL)
+        except BaseException:
+            if db.in_transaction:
+                await db.execute("ROLLBACK;")
+            raise
+
+
+async def _migrate_accounts_balance(db: aiosqlite.Connection) -> None:
+    """
+    Older DBs have no accounts.balance column: add it and backfill once from the ledger.
+    """
+    cur = await db.execute("PRAGMA table_info(accounts);")
+    columns = {r[1] for r in await cur.fetchall()}
+    if not columns or "balance" in columns:
+        return  # fresh DB: _SCHEMA_SQL creates the table with the column
+
+    await db.execute("ALTER TABLE accounts ADD COLUMN balance INTEGER NOT NULL DEFAULT 0;")
+    await db.execute(
+        """
+        UPDATE accounts SET balance =
+          COALESCE((SELECT SUM(amount) FROM transactions
+                    WHERE to_account_id = accounts.id AND status IN ('SUCCESS', 'FORCED')), 0) -
+          COALESCE((SELECT SUM(amount) FROM transactions
+                    WHERE from_account_id = accounts.id AND status IN ('SUCCESS', 'FORCED')), 0);
+        """
+    )
+
+
+async def _migrate_tx_epoch(db: aiosqlite.Connection) -> None:
+    """
+    Older DBs have no transactions.ts_epoch column: add it and backfill once from ts_utc.
+    """
+    cur = await db.execute("PRAGMA table_info(transactions);")
+    columns = {r[1] for r in await cur.fetchall()}
+    if not columns or "ts_epoch" in columns:
+        return  # fresh DB: _SCHEMA_SQL creates the table with the column
+
+    await db.execute("ALTER TABLE transactions ADD COLUMN ts_epoch INTEGER;")
+    await db.execute("UPDATE transactions SET ts_epoch = CAST(strftime('%s', ts_utc) AS INTEGER);")
+
 
-        await db.execute(
-            "INSERT INTO owners(tg_user_id, active_account_id, created_at) VALUES (?, NULL, ?);",
-            (tg_user_id, _utc_now_iso()),
-        )
-        await db.commit()
+async def _upsert_owner(db: aiosqlite.Connection, tg_user_id: int) -> None:
+    """
+    Idempotent owner insert: no read-before-write, existing rows are left untouched.
+    """
+    await db.execute(_SQL_UPSERT_OWNER, (tg_user_id,))
 
 
 async def create_account(tg_user_id: int, kind: str, label: str, set_active: bool = True) -> int:
@@ -135,6 +325,20 @@ async def create_account(tg_user_id: int, kind: str, label: str, set_active: boo
     Creates an account for owner and optionally makes it active.
     Returns new account_id.
     """
+    async with transaction() as db:
+        return await insert_account(db, tg_user_id, kind, label, set_active)
+
+
+async def insert_account(
+    db: aiosqlite.Connection,
+    tg_user_id: int,
+    kind: str,
+    label: str,
+    set_active: bool = True,
+) -> int:
+    """
+    create_account() inside the caller's transaction(), for check-then-create callers.
+    """
     kind = kind.strip().lower()
     if not kind:
         raise ValueError("kind is required")
@@ -143,103 +347,59 @@ async def create_account(tg_user_id: int, kind: str, label: str, set_active: boo
     if not label:
         raise ValueError("label is required")
 
-    await get_or_create_owner(tg_user_id)
+    await _upsert_owner(db, tg_user_id)
 
-    async with aiosqlite.connect(settings.DB_PATH) as db:
-        await db.execute("PRAGMA foreign_keys=ON;")
-        cur = await db.execute(
-            """
-            INSERT INTO accounts(owner_tg_id, kind, label, is_active, created_at)
-            VALUES (?, ?, ?, 1, ?);
-            """,
-            (tg_user_id, kind, label, _utc_now_iso()),
-        )
-        account_id = cur.lastrowid
+    cur = await db.execute(_SQL_INSERT_ACCOUNT, (tg_user_id, kind, label))
+    (account_id,) = await cur.fetchone()
 
-        if set_active:
-            await db.execute(
-                "UPDATE owners SET active_account_id = ? WHERE tg_user_id = ?;",
-                (account_id, tg_user_id),
-            )
+    if set_active:
+        await db.execute(_SQL_SET_ACTIVE, (account_id, tg_user_id))
 
-        await db.commit()
-        return int(account_id)
+    return int(account_id)
 
 
 async def list_accounts(tg_user_id: int) -> Tuple[Optional[int], List[Account]]:
     """
     Returns (active_account_id, accounts[])
+    Pure read: an unknown user simply gets (None, []); the owner row is created
+    by create_account, not here.
     """
-    await get_or_create_owner(tg_user_id)
-
-    async with aiosqlite.connect(settings.DB_PATH) as db:
-        await db.execute("PRAGMA foreign_keys=ON;")
-
-        cur = await db.execute("SELECT active_account_id FROM owners WHERE tg_user_id = ?;", (tg_user_id,))
+    async with read_db() as db:
+        cur = await db.execute(_SQL_ACTIVE_ID, (tg_user_id,))
         row = await cur.fetchone()
         active_id = row[0] if row else None
 
-        cur = await db.execute(
-            """
-            SELECT id, owner_tg_id, kind, label, is_active, created_at
-            FROM accounts
-            WHERE owner_tg_id = ?
-            ORDER BY id ASC;
-            """,
-            (tg_user_id,),
-        )
+        cur = await db.execute(_SQL_LIST_ACCOUNTS, (tg_user_id,))
         rows = await cur.fetchall()
 
-        accounts = [
-            Account(
-                id=r[0],
-                owner_tg_id=r[1],
-                kind=r[2],
-                label=r[3],
-                is_active=r[4],
-                created_at=r[5],
-            )
-            for r in rows
-        ]
-        return active_id, accounts
-
-
-async def set_active_account(tg_user_id: int, account_id: int) -> None:
-    """
-    Sets active account if it belongs to the user and is_active=1
-    """
-    await get_or_create_owner(tg_user_id)
-
-    async with aiosqlite.connect(settings.DB_PATH) as db:
-        await db.execute("PRAGMA foreign_keys=ON;")
-
-        cur = await db.execute(
-            """
-            SELECT id FROM accounts
-            WHERE id = ? AND owner_tg_id = ? AND is_active = 1
-            LIMIT 1;
-            """,
-            (account_id, tg_user_id),
-        )
-        row = await cur.fetchone()
-        if not row:
+    # SELECT column order == Account field order
+    accounts = [Account(*r) for r in rows]
+    return active_id, accounts
+
+
+async def set_active_account(tg_user_id: int, account_id: int) -> Account:
+    """
+    Sets active account if it belongs to the user and is_active=1.
+    Returns the now-active account.
+    """
+    async with transaction() as db:
+        cur = await db.execute(_SQL_OWNED_ACCOUNT, (account_id, tg_user_id))
+        r = await cur.fetchone()
+        if not r:
             raise ValueError("account not found or not accessible")
 
-        await db.execute(
-            "UPDATE owners SET active_account_id = ? WHERE tg_user_id = ?;",
-            (account_id, tg_user_id),
-        )
-        await db.commit()
+        await db.execute(_SQL_SET_ACTIVE, (account_id, tg_user_id))
+
+    return Account(*r)
 
 
 async def get_active_account(tg_user_id: int) -> Optional[Account]:
     """
     Returns active account object, or None if user has no accounts yet.
     """
-    active_id, accounts = await list_accounts(tg_user_id)
-    if not active_id:
+    async with read_db() as db:
+        cur = await db.execute(_SQL_ACTIVE_ACCOUNT, (tg_user_id,))
+        r = await cur.fetchone()
+    if not r:
         return None
-    for acc in accounts:
-        if acc.id == active_id:
-            return acc
-    return None
+    return Account(*r)
@@ -1,28 +1,21 @@
-from aiogram import F
+import re
+
+from aiogram.filters import Command, CommandObject
 from aiogram.types import Message
 from aiogram.dispatcher.router import Router
 
 from app.db import (
-    init_db,
     list_accounts,
     set_active_account,
     create_account,
-    get_active_account,
 )
 
 router = Router()
 
-
-@router.message(F.text == "/init")
-async def init_handler(message: Message):
-    """
-    One-time DB init command.
-    """
-    await init_db()
-    await message.answer("DB INIT OK")
+_SWITCH_RE = re.compile(r"^(\d+)\s*$")
 
 
-@router.message(F.text == "/accounts")
+@router.message(Command("accounts"))
 async def list_accounts_handler(message: Message):
     """
     Shows all accounts and current active one.
@@ -48,33 +41,32 @@ async def list_accounts_handler(message: Message):
     await message.answer("\n".join(lines))
 
 
-@router.message(F.text.startswith("/switch"))
-async def switch_account_handler(message: Message):
+@router.message(Command("switch"))
+async def switch_account_handler(message: Message, command: CommandObject):
     """
     Switch active account.
     """
-    parts = message.text.split()
-    if len(parts) != 2 or not parts[1].isdigit():
+    m = _SWITCH_RE.match(command.args or "")
+    if not m:
         await message.answer("Usage: /switch <account_id>")
         return
 
-    account_id = int(parts[1])
+    account_id = int(m.group(1))
     tg_id = message.from_user.id
 
     try:
-        await set_active_account(tg_id, account_id)
+        acc = await set_active_account(tg_id, account_id)
     except Exception as e:
         await message.answer(f"Error: {e}")
         return
 
-    acc = await get_active_account(tg_id)
     await message.answer(
         f"Active account switched to:\n"
         f"{acc.label} ({acc.kind})"
     )
 
 
-@router.message(F.text == "/new_personal")
+@router.message(Command("new_personal"))
 async def new_personal_handler(message: Message):
     tg_id = message.from_user.id
     acc_id = await create_account(
@@ -86,7 +78,7 @@ async def new_personal_handler(message: Message):
     await message.answer(f"Personal account created. ID: {acc_id}")
 
 
-@router.message(F.text == "/new_business")
+@router.message(Command("new_business"))
 async def new_business_handler(message: Message):
     tg_id = message.from_user.id
     acc_id = await create_account(
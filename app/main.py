@@ -1,24 +1,34 @@
 import asyncio
+import json
 import os
-from io import BytesIO
+import re
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List
 
-import aiosqlite
 from aiogram import Bot, Dispatcher, F
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.filters import Command, CommandObject
 from aiogram.types import Message, BufferedInputFile, CallbackQuery
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from app.config import settings
 from app.db import (
     init_db,
+    close_db,
+    read_db,
+    write_fetchall,
     get_active_account,
     list_accounts,
     set_active_account,
 )
 from app.handlers.accounts import router as accounts_router
+from app.middlewares import ChatOrderMiddleware
 from app.banking import (
     transfer as banking_transfer,
     get_last_7_days,
     get_balance,
+    get_active_balance,
 )
 from app.admin import (
     ensure_owner_seed,
@@ -35,10 +45,19 @@ from app.payroll import (
     run_payroll,
     ensure_payroll_schema,
 )
-from app.receipt.generator import generate_receipt
+from app.receipt.generator import RECEIPT_EXT, render_receipt, warm_up as warm_up_receipts
 
 CURRENCY_UNIT = "SOLEN"
 
+_PAYROLL_SEND_CONCURRENCY = 8
+
+# Argument shapes for CommandObject.args (text after "/cmd").
+_ID_RE = re.compile(r"^(\d+)\s*$")  # <id>
+_ID_PAIR_RE = re.compile(r"^(\d+)\s+(\d+)\s*$")  # <id> <id>
+_TRANSFER_RE = re.compile(r"^(\d+)\s+(\d+)\s+(.+)$", re.S)  # <to> <amount> <text>
+_FORCE_RE = re.compile(r"^(\d+)\s+(\d+)\s+(\d+)\s+(.+)$", re.S)  # <n> <n> <n> <text>
+_PAYROLL_RE = re.compile(r"^(\d+)\s+(\d+)\s+(\d+)(?:\s+(.*))?$", re.S)  # <biz> <YYYY> <MM> [note]
+
 
 def _ensure_db_dir():
     # If DB_PATH contains a directory (e.g. data/bot.db), create it.
@@ -50,6 +69,27 @@ def _ensure_db_dir():
 
 # ───────── UI (Inline Menu) ─────────
 
+MENU_TEXT = "ECLIS BANKING SYSTEM\n\nSelect an action:"
+TRANSFER_HELP_TEXT = "Use:\n/transfer <to_account_id> <amount> <description>"
+ADMIN_HELP_TEXT = (
+    "Admin:\n"
+    "/pool_balance\n"
+    "/pool_give <to_account_id> <amount> <desc>\n"
+    "/force <from_account_id> <to_account_id> <amount> <desc>\n"
+    "/biz_register <business_account_id>\n"
+    "/staff_add <business_account_id> <staff_account_id> <salary> <name...>\n"
+    "/staff_list <business_account_id>\n"
+    "/staff_link <staff_id> <tg_id>\n"
+    "/staff_unlink <staff_id>\n"
+    "/payroll <business_account_id> <YYYY> <MM> <note...>\n"
+    "\nOwner-only:\n"
+    "/set_owner <tg_id>\n"
+    "/admin_add <tg_id>\n"
+    "/admin_remove <tg_id>"
+)
+NO_ACTIVE_ACCOUNT_TEXT = "No active account. Create: /new_personal or /new_business"
+
+
 def build_main_menu():
     kb = InlineKeyboardBuilder()
     kb.button(text="Balance", callback_data="menu:balance")
@@ -61,89 +101,169 @@ def build_main_menu():
     return kb.as_markup()
 
 
-async def send_menu_to_message(msg: Message):
-    await msg.answer("ECLIS BANKING SYSTEM\n\nSelect an action:", reply_markup=build_main_menu())
-
+# The menu never changes: build it once.
+MAIN_MENU = build_main_menu()
 
-# ───────── Receipt regeneration (for payroll sending) ─────────
 
-async def _regen_receipt_png(receipt_no: str) -> bytes:
-    _ensure_db_dir()
-    async with aiosqlite.connect(settings.DB_PATH) as db:
-        cur = await db.execute(
-            """
-            SELECT from_account_id, to_account_id, amount, status, COALESCE(description,'')
-            FROM transactions
-            WHERE receipt_no = ?
-            LIMIT 1;
-            """,
-            (receipt_no,),
+async def send_menu_to_message(msg: Message):
+    await msg.answer(MENU_TEXT, reply_markup=MAIN_MENU)
+
+
+# ───────── Payroll lookups ─────────
+
+# staff_link / staff_unlink (NULL): RETURNING tells a missing id apart in the same trip.
+_SQL_STAFF_SET_TG = "UPDATE business_staff SET staff_tg_id = ? WHERE id = ? RETURNING id;"
+
+# Id lists are bound as one JSON array parameter.
+_SQL_PAID_STAFF = """
+    SELECT id, staff_name, staff_tg_id FROM business_staff
+    WHERE id IN (SELECT value FROM json_each(?));
+"""
+
+
+class _SendPacer:
+    """
+    Paces the payroll fan-out below Telegram's flood limits (~30 msg/s per bot,
+    ~1 msg/s per chat). GCRA: up to `burst` sends pass at once, then 1/rate apart.
+    """
+
+    _PRUNE_AT = 1024
+
+    def __init__(self, global_rate: float = 25.0, chat_rate: float = 1.0, burst: int = 3) -> None:
+        self._global_interval = 1.0 / global_rate
+        self._chat_interval = 1.0 / chat_rate
+        self._burst = burst
+        self._global_tat = 0.0
+        self._chat_tat: Dict[int, float] = {}
+
+    def _reserve(self, chat_id: int, now: float) -> float:
+        """
+        Books a send slot for chat_id and returns its start time. No await inside:
+        concurrent callers get consecutive slots.
+        """
+        slack = self._burst - 1
+        chat_tat = self._chat_tat.get(chat_id, now)
+        at = max(
+            now,
+            chat_tat - slack * self._chat_interval,
+            self._global_tat - slack * self._global_interval,
         )
-        tx = await cur.fetchone()
-        if not tx:
-            raise ValueError("receipt not found")
+        self._chat_tat[chat_id] = max(chat_tat, at) + self._chat_interval
+        self._global_tat = max(self._global_tat, at) + self._global_interval
 
-        from_id, to_id, amount, status, desc = tx
+        if len(self._chat_tat) > self._PRUNE_AT:
+            self._chat_tat = {k: t for k, t in self._chat_tat.items() if t > now}
+        return at
 
-        def _fmt(label, kind, acc_id):
-            return f"{label} ({kind}) [ID:{acc_id}]"
+    async def wait(self, chat_id: int) -> None:
+        now = asyncio.get_running_loop().time()
+        delay = self._reserve(chat_id, now) - now
+        if delay > 0:
+            await asyncio.sleep(delay)
 
-        if from_id is None:
-            sender_display = "SYSTEM"
-        else:
-            cur = await db.execute("SELECT label, kind FROM accounts WHERE id = ? LIMIT 1;", (int(from_id),))
-            r = await cur.fetchone()
-            sender_display = _fmt(r[0], r[1], int(from_id)) if r else f"ACCOUNT [ID:{from_id}]"
 
-        if to_id is None:
-            receiver_display = "SYSTEM"
-        else:
-            cur = await db.execute("SELECT label, kind FROM accounts WHERE id = ? LIMIT 1;", (int(to_id),))
-            r = await cur.fetchone()
-            receiver_display = _fmt(r[0], r[1], int(to_id)) if r else f"ACCOUNT [ID:{to_id}]"
+# shared by concurrent payroll runs: the per-bot budget is global
+_payroll_pacer = _SendPacer()
+
+
+# ───────── Receipt regeneration (for payroll sending) ─────────
 
-    receipt_no2, image = generate_receipt(
-        sender_account=sender_display,
-        receiver_account=receiver_display,
+# Regenerated receipts never change (write-once ledger rows): LRU by receipt_no,
+# ~17 KB each, so ~9 MB.
+_RECEIPT_CACHE_SIZE = 512
+_receipt_image_cache: "OrderedDict[str, bytes]" = OrderedDict()
+
+# Ledger rows + both account labels in one statement (LEFT JOIN: system rows and
+# deleted accounts have no label).
+_SQL_RECEIPT_ROWS = """
+    SELECT t.receipt_no,
+           t.from_account_id, t.to_account_id, t.amount, t.status, COALESCE(t.description,''), t.ts_epoch,
+           af.label, af.kind, at.label, at.kind
+    FROM transactions AS t
+    LEFT JOIN accounts AS af ON af.id = t.from_account_id
+    LEFT JOIN accounts AS at ON at.id = t.to_account_id
+    WHERE t.receipt_no IN (SELECT value FROM json_each(?));
+"""
+
+
+def _fmt_account(acc_id, label, kind) -> str:
+    """
+    Receipt display for one side of a ledger row (id + LEFT JOINed label/kind).
+    """
+    if acc_id is None:
+        return "SYSTEM"
+    if label is None:  # account row gone
+        return f"ACCOUNT [ID:{acc_id}]"
+    return f"{label} ({kind}) [ID:{acc_id}]"
+
+
+async def _fetch_receipt_rows(db, receipt_nos: List[str]) -> Dict[str, tuple]:
+    """
+    receipt_no -> row of _SQL_RECEIPT_ROWS (without the key), for every found receipt.
+    """
+    rows = await db.execute_fetchall(_SQL_RECEIPT_ROWS, (json.dumps(receipt_nos),))
+    return {r[0]: r[1:] for r in rows}
+
+
+async def _regen_receipt_image(receipt_no: str, row: tuple) -> bytes:
+    """
+    Re-renders a receipt from its _fetch_receipt_rows() row (LRU-cached by receipt_no).
+    """
+    image = _receipt_image_cache.get(receipt_no)
+    if image is not None:
+        _receipt_image_cache.move_to_end(receipt_no)
+        return image
+
+    from_id, to_id, amount, status, desc, ts_epoch, from_label, from_kind, to_label, to_kind = row
+
+    # drawing + encoding go to a worker thread (payroll renders several at once)
+    image = await asyncio.to_thread(
+        render_receipt,
+        sender_account=_fmt_account(from_id, from_label, from_kind),
+        receiver_account=_fmt_account(to_id, to_label, to_kind),
         amount=int(amount),
         status=str(status),
         description=str(desc),
-        receipt_no=str(receipt_no),
+        receipt_no=receipt_no,
+        # booking time, not "now": keeps the render deterministic (and cacheable)
+        issued_at=datetime.fromtimestamp(ts_epoch, timezone.utc) if ts_epoch is not None else None,
     )
-
-    bio = BytesIO()
-    bio.name = f"receipt_{receipt_no2}.png"
-    image.save(bio, format="PNG")
-    return bio.getvalue()
+    _receipt_image_cache[receipt_no] = image
+    if len(_receipt_image_cache) > _RECEIPT_CACHE_SIZE:
+        _receipt_image_cache.popitem(last=False)
+    return image
 
 
 # ───────── Helpers without mutating Message (fix frozen_instance) ─────────
 
 async def show_balance(user_id: int, reply_to: Message):
-    acc = await get_active_account(user_id)
-    if not acc:
-        await reply_to.answer("No active account. Create: /new_personal or /new_business")
+    found = await get_active_balance(user_id)
+    if not found:
+        await reply_to.answer(NO_ACTIVE_ACCOUNT_TEXT)
         return
-    bal = await get_balance(acc.id)
+    acc, bal = found
     await reply_to.answer(f"Balance for {acc.label} ({acc.kind}) [ID:{acc.id}]: {bal:,} {CURRENCY_UNIT}")
 
 
 async def show_history(user_id: int, reply_to: Message):
     acc = await get_active_account(user_id)
     if not acc:
-        await reply_to.answer("No active account. Create: /new_personal or /new_business")
+        await reply_to.answer(NO_ACTIVE_ACCOUNT_TEXT)
         return
     rows = await get_last_7_days(acc.id, limit=30)
     if not rows:
         await reply_to.answer("No transactions in last 7 days.")
         return
 
-    lines = [f"Last 7 days history for {acc.label} ({acc.kind}) [ID:{acc.id}]:"]
-    for r in rows:
-        direction = "OUT" if r.from_account_id == acc.id else "IN"
-        other = r.to_account_id if direction == "OUT" else r.from_account_id
-        lines.append(f"{direction} | {r.amount:,} {CURRENCY_UNIT} | {r.status} | other:{other} | #{r.receipt_no}")
-    await reply_to.answer("\n".join(lines))
+    acc_id = acc.id
+    body = [
+        f"OUT | {r.amount:,} {CURRENCY_UNIT} | {r.status} | other:{r.to_account_id} | #{r.receipt_no}"
+        if r.from_account_id == acc_id
+        else f"IN | {r.amount:,} {CURRENCY_UNIT} | {r.status} | other:{r.from_account_id} | #{r.receipt_no}"
+        for r in rows
+    ]
+    header = f"Last 7 days history for {acc.label} ({acc.kind}) [ID:{acc_id}]:"
+    await reply_to.answer(header + "\n" + "\n".join(body))
 
 
 # ───────── Core handlers ─────────
@@ -165,40 +285,40 @@ async def init_handler(message: Message):
 
 # ───────── OWNER / ADMIN ─────────
 
-async def set_owner_handler(message: Message):
-    parts = message.text.split()
-    if len(parts) != 2 or not parts[1].isdigit():
+async def set_owner_handler(message: Message, command: CommandObject):
+    m = _ID_RE.match(command.args or "")
+    if not m:
         await message.answer("Usage: /set_owner <tg_id>")
         return
     try:
-        await ensure_owner_seed(int(parts[1]))
+        await ensure_owner_seed(int(m.group(1)))
     except Exception as e:
         await message.answer(f"Failed: {e}")
         return
     await message.answer("OWNER set.")
 
 
-async def admin_add_handler(message: Message):
+async def admin_add_handler(message: Message, command: CommandObject):
     if not await is_owner(message.from_user.id):
         await message.answer("Only OWNER can add admins.")
         return
-    parts = message.text.split()
-    if len(parts) != 2 or not parts[1].isdigit():
+    m = _ID_RE.match(command.args or "")
+    if not m:
         await message.answer("Usage: /admin_add <tg_id>")
         return
-    await add_admin(int(parts[1]))
+    await add_admin(int(m.group(1)))
     await message.answer("Admin added.")
 
 
-async def admin_remove_handler(message: Message):
+async def admin_remove_handler(message: Message, command: CommandObject):
     if not await is_owner(message.from_user.id):
         await message.answer("Only OWNER can remove admins.")
         return
-    parts = message.text.split()
-    if len(parts) != 2 or not parts[1].isdigit():
+    m = _ID_RE.match(command.args or "")
+    if not m:
         await message.answer("Usage: /admin_remove <tg_id>")
         return
-    await remove_admin(int(parts[1]))
+    await remove_admin(int(m.group(1)))
     await message.answer("Admin removed.")
 
 
@@ -213,25 +333,22 @@ async def pool_balance_handler(message: Message):
     await message.answer(f"MAIN POOL balance: {bal:,} {CURRENCY_UNIT}")
 
 
-async def pool_give_handler(message: Message):
+async def pool_give_handler(message: Message, command: CommandObject):
     if not await is_admin(message.from_user.id):
         await message.answer("Admin only.")
         return
 
-    parts = message.text.split(maxsplit=3)
-    if len(parts) < 4:
+    m = _TRANSFER_RE.match(command.args or "")
+    if not m:
         await message.answer("Usage: /pool_give <to_account_id> <amount> <desc>")
         return
 
-    _, to_id_raw, amount_raw, desc = parts
-    if not to_id_raw.isdigit() or not amount_raw.isdigit():
-        await message.answer("Account ID and amount must be numeric.")
-        return
+    to_id_raw, amount_raw, desc = m.groups()
 
     pool_id = await get_main_pool_account_id()
 
     try:
-        receipt_no, png = await banking_transfer(
+        receipt_no, image, _ = await banking_transfer(
             from_account_id=pool_id,
             to_account_id=int(to_id_raw),
             amount=int(amount_raw),
@@ -244,28 +361,25 @@ async def pool_give_handler(message: Message):
         return
 
     await message.answer_photo(
-        BufferedInputFile(png, filename=f"receipt_{receipt_no}.png"),
+        BufferedInputFile(image, filename=f"receipt_{receipt_no}.{RECEIPT_EXT}"),
         caption=f"POOL TRANSFER OK\nReceipt: {receipt_no}",
     )
 
 
-async def force_transfer_handler(message: Message):
+async def force_transfer_handler(message: Message, command: CommandObject):
     if not await is_admin(message.from_user.id):
         await message.answer("Admin only.")
         return
 
-    parts = message.text.split(maxsplit=4)
-    if len(parts) < 5:
+    m = _FORCE_RE.match(command.args or "")
+    if not m:
         await message.answer("Usage: /force <from_id> <to_id> <amount> <desc>")
         return
 
-    _, from_raw, to_raw, amount_raw, desc = parts
-    if not (from_raw.isdigit() and to_raw.isdigit() and amount_raw.isdigit()):
-        await message.answer("IDs and amount must be numeric.")
-        return
+    from_raw, to_raw, amount_raw, desc = m.groups()
 
     try:
-        receipt_no, png = await banking_transfer(
+        receipt_no, image, _ = await banking_transfer(
             from_account_id=int(from_raw),
             to_account_id=int(to_raw),
             amount=int(amount_raw),
@@ -278,25 +392,25 @@ async def force_transfer_handler(message: Message):
         return
 
     await message.answer_photo(
-        BufferedInputFile(png, filename=f"receipt_{receipt_no}.png"),
+        BufferedInputFile(image, filename=f"receipt_{receipt_no}.{RECEIPT_EXT}"),
         caption=f"FORCED TRANSFER OK\nReceipt: {receipt_no}",
     )
 
 
 # ───────── PAYROLL (ADMIN) ─────────
 
-async def biz_register_handler(message: Message):
+async def biz_register_handler(message: Message, command: CommandObject):
     if not await is_admin(message.from_user.id):
         await message.answer("Admin only.")
         return
 
-    parts = message.text.split()
-    if len(parts) != 2 or not parts[1].isdigit():
+    m = _ID_RE.match(command.args or "")
+    if not m:
         await message.answer("Usage: /biz_register <business_account_id>")
         return
 
     try:
-        await register_business_account(message.from_user.id, int(parts[1]))
+        await register_business_account(message.from_user.id, int(m.group(1)))
     except Exception as e:
         await message.answer(f"Failed: {e}")
         return
@@ -304,20 +418,17 @@ async def biz_register_handler(message: Message):
     await message.answer("Business account registered.")
 
 
-async def staff_add_handler(message: Message):
+async def staff_add_handler(message: Message, command: CommandObject):
     if not await is_admin(message.from_user.id):
         await message.answer("Admin only.")
         return
 
-    parts = message.text.split(maxsplit=4)
-    if len(parts) < 5:
+    m = _FORCE_RE.match(command.args or "")
+    if not m:
         await message.answer("Usage: /staff_add <biz_id> <staff_account_id> <salary> <name...>")
         return
 
-    _, biz_raw, staff_acc_raw, salary_raw, name = parts
-    if not (biz_raw.isdigit() and staff_acc_raw.isdigit() and salary_raw.isdigit()):
-        await message.answer("biz_id, staff_account_id, salary must be numeric.")
-        return
+    biz_raw, staff_acc_raw, salary_raw, name = m.groups()
 
     try:
         staff_id = await add_staff(
@@ -335,18 +446,18 @@ async def staff_add_handler(message: Message):
     await message.answer(f"Staff added. Staff ID: {staff_id}\n(Optional) Link TG: /staff_link {staff_id} <tg_id>")
 
 
-async def staff_list_handler(message: Message):
+async def staff_list_handler(message: Message, command: CommandObject):
     if not await is_admin(message.from_user.id):
         await message.answer("Admin only.")
         return
 
-    parts = message.text.split()
-    if len(parts) != 2 or not parts[1].isdigit():
+    m = _ID_RE.match(command.args or "")
+    if not m:
         await message.answer("Usage: /staff_list <business_account_id>")
         return
 
     try:
-        rows = await list_staff(message.from_user.id, int(parts[1]))
+        rows = await list_staff(message.from_user.id, int(m.group(1)))
     except Exception as e:
         await message.answer(f"Failed: {e}")
         return
@@ -355,7 +466,7 @@ async def staff_list_handler(message: Message):
         await message.answer("No staff found.")
         return
 
-    lines = [f"Staff list for business account {parts[1]}:"]
+    lines = [f"Staff list for business account {m.group(1)}:"]
     for r in rows:
         staff_id, staff_name, staff_tg_id, staff_account_id, monthly_salary, is_active = r
         status = "ACTIVE" if is_active else "OFF"
@@ -367,67 +478,57 @@ async def staff_list_handler(message: Message):
     await message.answer("\n".join(lines))
 
 
-async def staff_link_handler(message: Message):
+async def staff_link_handler(message: Message, command: CommandObject):
     if not await is_admin(message.from_user.id):
         await message.answer("Admin only.")
         return
 
-    parts = message.text.split()
-    if len(parts) != 3 or not parts[1].isdigit() or not parts[2].isdigit():
+    m = _ID_PAIR_RE.match(command.args or "")
+    if not m:
         await message.answer("Usage: /staff_link <staff_id> <tg_id>")
         return
 
-    staff_id = int(parts[1])
-    tg_id = int(parts[2])
+    staff_id = int(m.group(1))
+    tg_id = int(m.group(2))
 
-    _ensure_db_dir()
-    async with aiosqlite.connect(settings.DB_PATH) as db:
-        await db.execute("PRAGMA foreign_keys=ON;")
-        await db.execute("UPDATE business_staff SET staff_tg_id = ? WHERE id = ?;", (tg_id, staff_id))
-        await db.commit()
+    if not await write_fetchall(_SQL_STAFF_SET_TG, (tg_id, staff_id)):
+        await message.answer("Staff not found.")
+        return
 
     await message.answer("Staff TG ID linked.")
 
 
-async def staff_unlink_handler(message: Message):
+async def staff_unlink_handler(message: Message, command: CommandObject):
     if not await is_admin(message.from_user.id):
         await message.answer("Admin only.")
         return
 
-    parts = message.text.split()
-    if len(parts) != 2 or not parts[1].isdigit():
+    m = _ID_RE.match(command.args or "")
+    if not m:
         await message.answer("Usage: /staff_unlink <staff_id>")
         return
 
-    staff_id = int(parts[1])
+    staff_id = int(m.group(1))
 
-    _ensure_db_dir()
-    async with aiosqlite.connect(settings.DB_PATH) as db:
-        await db.execute("PRAGMA foreign_keys=ON;")
-        await db.execute("UPDATE business_staff SET staff_tg_id = NULL WHERE id = ?;", (staff_id,))
-        await db.commit()
+    if not await write_fetchall(_SQL_STAFF_SET_TG, (None, staff_id)):
+        await message.answer("Staff not found.")
+        return
 
     await message.answer("Staff TG ID unlinked.")
 
 
-async def payroll_run_handler(message: Message):
+async def payroll_run_handler(message: Message, command: CommandObject):
     if not await is_admin(message.from_user.id):
         await message.answer("Admin only.")
         return
 
-    parts = message.text.split(maxsplit=4)
-    if len(parts) < 4:
+    m = _PAYROLL_RE.match(command.args or "")
+    if not m:
         await message.answer("Usage: /payroll <biz_id> <YYYY> <MM> <note...>")
         return
 
-    biz_raw = parts[1]
-    year_raw = parts[2]
-    month_raw = parts[3]
-    note = parts[4] if len(parts) == 5 else ""
-
-    if not (biz_raw.isdigit() and year_raw.isdigit() and month_raw.isdigit()):
-        await message.answer("biz_id, YYYY, MM must be numeric.")
-        return
+    biz_raw, year_raw, month_raw, note = m.groups()
+    note = note or ""
 
     biz_id = int(biz_raw)
     year = int(year_raw)
@@ -449,53 +550,54 @@ async def payroll_run_handler(message: Message):
         await message.answer("Payroll done, but no active staff.")
         return
 
-    # lookup staff tg ids
-    _ensure_db_dir()
-    async with aiosqlite.connect(settings.DB_PATH) as db:
-        cur = await db.execute(
-            "SELECT id, staff_name, staff_tg_id FROM business_staff WHERE business_account_id = ?;",
-            (biz_id,),
+    # paid staff tg ids + every receipt's ledger row: two queries per run
+    async with read_db() as db:
+        staff_rows = await db.execute_fetchall(
+            _SQL_PAID_STAFF, (json.dumps([staff_id for staff_id, _ in results]),)
         )
-        staff_rows = await cur.fetchall()
-
-    staff_map = {int(r[0]): (str(r[1]), (int(r[2]) if r[2] is not None else None)) for r in staff_rows}
+        receipt_rows = await _fetch_receipt_rows(db, [receipt_no for _, receipt_no in results])
 
-    sent = 0
-    not_linked = 0
-    failed = 0
-    total_paid = 0
+    staff_map = {staff_id: (name, tg_id) for staff_id, name, tg_id in staff_rows}
+    total_paid = sum(int(row[2]) for row in receipt_rows.values())
 
-    for staff_id, receipt_no in results:
-        _name, tg_id = staff_map.get(int(staff_id), (f"staff#{staff_id}", None))
-
-        try:
-            png = await _regen_receipt_png(str(receipt_no))
-            _ensure_db_dir()
-            async with aiosqlite.connect(settings.DB_PATH) as db:
-                cur = await db.execute("SELECT amount FROM transactions WHERE receipt_no = ? LIMIT 1;", (str(receipt_no),))
-                r = await cur.fetchone()
-                if r:
-                    total_paid += int(r[0])
-        except Exception:
-            png = None
+    # render + upload concurrently, capped
+    sem = asyncio.Semaphore(_PAYROLL_SEND_CONCURRENCY)
 
+    async def _deliver(staff_id: int, receipt_no: str) -> str:
+        _name, tg_id = staff_map.get(staff_id, (f"staff#{staff_id}", None))
         if tg_id is None:
-            not_linked += 1
-            continue
-
-        if png is None:
-            failed += 1
-            continue
-
-        try:
-            await message.bot.send_photo(
-                chat_id=tg_id,
-                photo=BufferedInputFile(png, filename=f"receipt_{receipt_no}.png"),
-                caption=f"Salary payment receipt.\nReceipt No: {receipt_no}",
-            )
-            sent += 1
-        except Exception:
-            failed += 1
+            return "not_linked"
+
+        async with sem:
+            row = receipt_rows.get(receipt_no)
+            if row is None:
+                return "failed"
+            try:
+                image = await _regen_receipt_image(receipt_no, row)
+            except Exception:
+                return "failed"
+
+            for attempt in range(2):
+                await _payroll_pacer.wait(tg_id)
+                try:
+                    await message.bot.send_photo(
+                        chat_id=tg_id,
+                        photo=BufferedInputFile(image, filename=f"receipt_{receipt_no}.{RECEIPT_EXT}"),
+                        caption=f"Salary payment receipt.\nReceipt No: {receipt_no}",
+                    )
+                    return "sent"
+                except TelegramRetryAfter as e:
+                    if attempt:
+                        return "failed"
+                    await asyncio.sleep(e.retry_after)
+                except Exception:
+                    return "failed"
+            return "failed"
+
+    outcomes = await asyncio.gather(*(_deliver(staff_id, receipt_no) for staff_id, receipt_no in results))
+    sent = outcomes.count("sent")
+    not_linked = outcomes.count("not_linked")
+    failed = outcomes.count("failed")
 
     await message.answer(
         "Payroll executed.\n"
@@ -514,16 +616,13 @@ async def balance_handler(message: Message):
     await show_balance(message.from_user.id, message)
 
 
-async def transfer_handler(message: Message):
-    parts = message.text.split(maxsplit=3)
-    if len(parts) < 4:
+async def transfer_handler(message: Message, command: CommandObject):
+    m = _TRANSFER_RE.match(command.args or "")
+    if not m:
         await message.answer("Usage: /transfer <to_account_id> <amount> <desc>")
         return
 
-    _, to_raw, amount_raw, desc = parts
-    if not to_raw.isdigit() or not amount_raw.isdigit():
-        await message.answer("Account ID and amount must be numeric.")
-        return
+    to_raw, amount_raw, desc = m.groups()
 
     sender = await get_active_account(message.from_user.id)
     if not sender:
@@ -533,7 +632,7 @@ async def transfer_handler(message: Message):
     to_account_id = int(to_raw)
 
     try:
-        receipt_no, png = await banking_transfer(
+        receipt_no, image, receiver_owner_tg_id = await banking_transfer(
             from_account_id=sender.id,
             to_account_id=to_account_id,
             amount=int(amount_raw),
@@ -545,31 +644,20 @@ async def transfer_handler(message: Message):
         await message.answer(f"Transfer failed: {e}")
         return
 
-    filename = f"receipt_{receipt_no}.png"
-
-    await message.answer_photo(
-        BufferedInputFile(png, filename=filename),
+    sent = await message.answer_photo(
+        BufferedInputFile(image, filename=f"receipt_{receipt_no}.{RECEIPT_EXT}"),
         caption=f"Transfer OK\nReceipt: {receipt_no}",
     )
+    del image  # from here on the receipt is referenced by file_id only
 
-    # receiver (best-effort)
+    # receiver (best-effort): after the sender's send, so it can reuse that upload's file_id
     try:
-        _ensure_db_dir()
-        async with aiosqlite.connect(settings.DB_PATH) as db:
-            cur = await db.execute(
-                "SELECT owner_tg_id FROM accounts WHERE id = ? AND is_active = 1 LIMIT 1;",
-                (to_account_id,),
+        if receiver_owner_tg_id not in (message.from_user.id, 0):
+            await message.bot.send_photo(
+                chat_id=receiver_owner_tg_id,
+                photo=sent.photo[-1].file_id,
+                caption=f"You received a transfer.\nReceipt: {receipt_no}",
             )
-            row = await cur.fetchone()
-
-        if row:
-            receiver_owner_tg_id = int(row[0])
-            if receiver_owner_tg_id not in (message.from_user.id, 0):
-                await message.bot.send_photo(
-                    chat_id=receiver_owner_tg_id,
-                    photo=BufferedInputFile(png, filename=filename),
-                    caption=f"You received a transfer.\nReceipt: {receipt_no}",
-                )
     except Exception:
         await message.answer("Note: Could not deliver receipt to receiver.")
 
@@ -580,118 +668,172 @@ async def history_handler(message: Message):
 
 # ───────── Callback handlers (Menu) ─────────
 
+async def _menu_accounts(user_id: int, msg: Message):
+    active_id, accounts = await list_accounts(user_id)
+    if not accounts:
+        await msg.answer("No accounts. Create: /new_personal or /new_business")
+        return
+
+    kb = InlineKeyboardBuilder()
+    for acc in accounts:
+        mark = "✅" if acc.id == active_id else "▫️"
+        kb.button(
+            text=f"{mark} {acc.label} ({acc.kind}) [ID:{acc.id}]",
+            callback_data=f"switch:{acc.id}",
+        )
+    kb.adjust(1)
+    await msg.answer("Select active account:", reply_markup=kb.as_markup())
+
+
+async def _menu_transfer(user_id: int, msg: Message):
+    await msg.answer(TRANSFER_HELP_TEXT)
+
+
+async def _menu_admin(user_id: int, msg: Message):
+    if not await is_admin(user_id):
+        await msg.answer("Admin only.")
+        return
+    await msg.answer(ADMIN_HELP_TEXT)
+
+
+# callback_data -> action(user_id, message): one dict lookup per button press
+_MENU_ACTIONS: Dict[str, Callable[[int, Message], Awaitable[None]]] = {
+    "menu:balance": show_balance,
+    "menu:accounts": _menu_accounts,
+    "menu:history": show_history,
+    "menu:transfer": _menu_transfer,
+    "menu:admin": _menu_admin,
+}
+
+
 async def on_menu_callback(call: CallbackQuery):
     await call.answer()
-    user_id = call.from_user.id
-    msg = call.message
-
-    if call.data == "menu:balance":
-        await show_balance(user_id, msg)
-
-    elif call.data == "menu:accounts":
-        active_id, accounts = await list_accounts(user_id)
-        if not accounts:
-            await msg.answer("No accounts. Create: /new_personal or /new_business")
-            return
-
-        kb = InlineKeyboardBuilder()
-        for acc in accounts:
-            mark = "✅" if acc.id == active_id else "▫️"
-            kb.button(
-                text=f"{mark} {acc.label} ({acc.kind}) [ID:{acc.id}]",
-                callback_data=f"switch:{acc.id}",
-            )
-        kb.adjust(1)
-        await msg.answer("Select active account:", reply_markup=kb.as_markup())
-
-    elif call.data == "menu:history":
-        await show_history(user_id, msg)
-
-    elif call.data == "menu:transfer":
-        await msg.answer("Use:\n/transfer <to_account_id> <amount> <description>")
-
-    elif call.data == "menu:admin":
-        if not await is_admin(user_id):
-            await msg.answer("Admin only.")
-            return
-        await msg.answer(
-            "Admin:\n"
-            "/pool_balance\n"
-            "/pool_give <to_account_id> <amount> <desc>\n"
-            "/force <from_account_id> <to_account_id> <amount> <desc>\n"
-            "/biz_register <business_account_id>\n"
-            "/staff_add <business_account_id> <staff_account_id> <salary> <name...>\n"
-            "/staff_list <business_account_id>\n"
-            "/staff_link <staff_id> <tg_id>\n"
-            "/staff_unlink <staff_id>\n"
-            "/payroll <business_account_id> <YYYY> <MM> <note...>\n"
-            "\nOwner-only:\n"
-            "/set_owner <tg_id>\n"
-            "/admin_add <tg_id>\n"
-            "/admin_remove <tg_id>"
-        )
+    action = _MENU_ACTIONS.get(call.data)
+    if action is not None:
+        await action(call.from_user.id, call.message)
 
 
 async def on_switch_callback(call: CallbackQuery):
     await call.answer()
-    data = call.data or ""
-    _, acc_id_str = data.split(":", 1)
-    if not acc_id_str.isdigit():
+    # "switch:<id>" is guaranteed by the filter; int() is the validation
+    try:
+        acc_id = int(call.data.removeprefix("switch:"))
+    except ValueError:
         await call.message.answer("Invalid switch payload.")
         return
 
-    acc_id = int(acc_id_str)
     try:
-        await set_active_account(call.from_user.id, acc_id)
+        acc = await set_active_account(call.from_user.id, acc_id)
     except Exception as e:
         await call.message.answer(f"Switch failed: {e}")
         return
 
-    acc = await get_active_account(call.from_user.id)
-    if not acc:
-        await call.message.answer("Active account set, but could not load it.")
-        return
-
     await call.message.answer(f"Active account: {acc.label} ({acc.kind}) [ID:{acc.id}]")
-    await call.message.answer("Menu:", reply_markup=build_main_menu())
-
+    await call.message.answer("Menu:", reply_markup=MAIN_MENU)
+
+
+async def _run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    """
+    Telegram pushes updates to /webhook/<secret> instead of long polling.
+    Updates are handled in background tasks, like handle_as_tasks.
+    """
+    from aiohttp import web
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+    secret = settings.WEBHOOK_SECRET
+    if not secret or not settings.WEBHOOK_BASE_URL:
+        raise RuntimeError("USE_WEBHOOK needs WEBHOOK_BASE_URL and WEBHOOK_SECRET")
+    path = f"/webhook/{secret}"
+
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=secret,
+        handle_in_background=True,
+    ).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, settings.WEBAPP_HOST, settings.WEBAPP_PORT).start()
+        await bot.set_webhook(
+            settings.WEBHOOK_BASE_URL.rstrip("/") + path,
+            secret_token=secret,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        await asyncio.Event().wait()  # serve until cancelled
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
 
-async def main():
-    _ensure_db_dir()
 
-    bot = Bot(token=settings.BOT_TOKEN)
+def build_dispatcher() -> Dispatcher:
+    """
+    Dispatcher with the middleware and every handler registered.
+    Call once per process: the accounts router can only be attached once.
+    """
     dp = Dispatcher()
+    # after the built-in user-context middleware, so event_chat is available
+    dp.update.outer_middleware(ChatOrderMiddleware())
 
     dp.include_router(accounts_router)
 
-    dp.message.register(start_handler, F.text == "/start")
-    dp.message.register(menu_handler, F.text == "/menu")
-    dp.message.register(init_handler, F.text == "/init")
-
-    dp.message.register(set_owner_handler, F.text.startswith("/set_owner"))
-    dp.message.register(admin_add_handler, F.text.startswith("/admin_add"))
-    dp.message.register(admin_remove_handler, F.text.startswith("/admin_remove"))
+    # handlers match in registration order: everyday commands first
+    dp.message.register(balance_handler, Command("balance"))
+    dp.message.register(transfer_handler, Command("transfer"))
+    dp.message.register(history_handler, Command("history"))
+    dp.message.register(menu_handler, Command("menu"))
+    dp.message.register(start_handler, Command("start"))
+    dp.message.register(init_handler, Command("init"))
+
+    dp.message.register(set_owner_handler, Command("set_owner"))
+    dp.message.register(admin_add_handler, Command("admin_add"))
+    dp.message.register(admin_remove_handler, Command("admin_remove"))
+
+    dp.message.register(pool_balance_handler, Command("pool_balance"))
+    dp.message.register(pool_give_handler, Command("pool_give"))
+    dp.message.register(force_transfer_handler, Command("force"))
+
+    dp.message.register(biz_register_handler, Command("biz_register"))
+    dp.message.register(staff_add_handler, Command("staff_add"))
+    dp.message.register(staff_list_handler, Command("staff_list"))
+    dp.message.register(staff_link_handler, Command("staff_link"))
+    dp.message.register(staff_unlink_handler, Command("staff_unlink"))
+    dp.message.register(payroll_run_handler, Command("payroll"))
 
-    dp.message.register(pool_balance_handler, F.text == "/pool_balance")
-    dp.message.register(pool_give_handler, F.text.startswith("/pool_give"))
-    dp.message.register(force_transfer_handler, F.text.startswith("/force"))
+    dp.callback_query.register(on_menu_callback, F.data.startswith("menu:"))
+    dp.callback_query.register(on_switch_callback, F.data.startswith("switch:"))
+    return dp
 
-    dp.message.register(biz_register_handler, F.text.startswith("/biz_register"))
-    dp.message.register(staff_add_handler, F.text.startswith("/staff_add"))
-    dp.message.register(staff_list_handler, F.text.startswith("/staff_list"))
-    dp.message.register(staff_link_handler, F.text.startswith("/staff_link"))
-    dp.message.register(staff_unlink_handler, F.text.startswith("/staff_unlink"))
-    dp.message.register(payroll_run_handler, F.text.startswith("/payroll"))
 
-    dp.message.register(balance_handler, F.text == "/balance")
-    dp.message.register(transfer_handler, F.text.startswith("/transfer"))
-    dp.message.register(history_handler, F.text == "/history")
+async def main():
+    _ensure_db_dir()
+    await init_db()
+    await ensure_payroll_schema()
+    await get_main_pool_account_id()  # seed + cache MAIN POOL once, off the hot path
+    # warm the receipt template and the read pool before the first /transfer
+    await asyncio.to_thread(warm_up_receipts)
+    async with read_db():
+        pass
 
-    dp.callback_query.register(on_menu_callback, F.data.startswith("menu:"))
-    dp.callback_query.register(on_switch_callback, F.data.startswith("switch:"))
+    bot = Bot(token=settings.BOT_TOKEN)
+    dp = build_dispatcher()
 
-    await dp.start_polling(bot)
+    try:
+        if settings.USE_WEBHOOK:
+            await _run_webhook(dp, bot)
+        else:
+            await dp.start_polling(bot, handle_as_tasks=True)
+    finally:
+        await close_db()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        import uvloop  # optional: faster event loop (not available on Windows)
+    except ImportError:
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
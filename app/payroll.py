@@ -1,24 +1,55 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from datetime import datetime, timezone
 from typing import List, Optional, Tuple
 
-import aiosqlite
-
-from app.config import settings
+from app.db import read_db, transaction
 from app.admin import is_admin
-from app.banking import transfer as banking_transfer
-
-
-def _utc_now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+from app.banking import book_transfers
+
+
+_SQL_ACCOUNT_ACTIVE = "SELECT 1 FROM accounts WHERE id = ? AND is_active = 1 LIMIT 1;"
+_SQL_UPSERT_BUSINESS = """
+    INSERT INTO business_accounts(account_id, is_active, created_at)
+    VALUES (?, 1, strftime('%Y-%m-%dT%H:%M:%S+00:00', 'now'))
+    ON CONFLICT(account_id) DO UPDATE SET is_active=1;
+"""
+# business registered + staff account exists, in one round-trip
+_SQL_STAFF_TARGETS_OK = """
+    SELECT
+      EXISTS(SELECT 1 FROM business_accounts WHERE account_id = ? AND is_active = 1),
+      EXISTS(SELECT 1 FROM accounts WHERE id = ? AND is_active = 1);
+"""
+_SQL_INSERT_STAFF = """
+    INSERT INTO business_staff(
+        business_account_id, staff_name, staff_tg_id, staff_account_id,
+        monthly_salary, is_active, created_at
+    )
+    VALUES (?, ?, ?, ?, ?, 1, strftime('%Y-%m-%dT%H:%M:%S+00:00', 'now'));
+"""
+_SQL_LIST_STAFF = """
+    SELECT id, staff_name, staff_tg_id, staff_account_id, monthly_salary, is_active
+    FROM business_staff
+    WHERE business_account_id = ?
+    ORDER BY id ASC;
+"""
+_SQL_INSERT_RUN = """
+    INSERT INTO payroll_runs(business_account_id, year, month, created_by_tg_id, created_at)
+    VALUES (?, ?, ?, ?, strftime('%Y-%m-%dT%H:%M:%S+00:00', 'now'));
+"""
+_SQL_ACTIVE_STAFF = """
+    SELECT id, staff_name, staff_account_id, monthly_salary
+    FROM business_staff
+    WHERE business_account_id = ?
+      AND is_active = 1;
+"""
 
 
 async def ensure_payroll_schema() -> None:
-    async with aiosqlite.connect(settings.DB_PATH) as db:
-        await db.execute("PRAGMA foreign_keys=ON;")
-
+    """
+    Payroll DDL. Runs at startup (main) and on /init, not on every payroll call.
+    """
+    async with transaction() as db:
         await db.execute(
             """
             CREATE TABLE IF NOT EXISTS business_accounts (
@@ -48,7 +79,8 @@ async def ensure_payroll_schema() -> None:
             """
         )
 
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_staff_business ON business_staff(business_account_id);")
+        # business-only lookups use the leftmost prefix of idx_staff_active
+        await db.execute("DROP INDEX IF EXISTS idx_staff_business;")
         await db.execute("CREATE INDEX IF NOT EXISTS idx_staff_active ON business_staff(business_account_id, is_active);")
 
         await db.execute(
@@ -67,33 +99,18 @@ async def ensure_payroll_schema() -> None:
             """
         )
 
-        await db.commit()
-
 
 async def register_business_account(admin_tg_id: int, account_id: int) -> None:
     if not await is_admin(admin_tg_id):
         raise PermissionError("admin only")
 
-    async with aiosqlite.connect(settings.DB_PATH) as db:
-        await db.execute("PRAGMA foreign_keys=ON;")
-
+    async with transaction() as db:
         # Must exist and active
-        cur = await db.execute(
-            "SELECT 1 FROM accounts WHERE id = ? AND is_active = 1 LIMIT 1;",
-            (account_id,),
-        )
+        cur = await db.execute(_SQL_ACCOUNT_ACTIVE, (account_id,))
         if not await cur.fetchone():
             raise ValueError("account not found")
 
-        await db.execute(
-            """
-            INSERT INTO business_accounts(account_id, is_active, created_at)
-            VALUES (?, 1, ?)
-            ON CONFLICT(account_id) DO UPDATE SET is_active=1;
-            """,
-            (account_id, _utc_now_iso()),
-        )
-        await db.commit()
+        await db.execute(_SQL_UPSERT_BUSINESS, (account_id,))
 
 
 async def add_staff(
@@ -114,64 +131,34 @@ async def add_staff(
     if monthly_salary <= 0:
         raise ValueError("monthly_salary must be > 0")
 
-    await ensure_payroll_schema()
-
-    async with aiosqlite.connect(settings.DB_PATH) as db:
-        await db.execute("PRAGMA foreign_keys=ON;")
-
-        # Ensure business is registered
-        cur = await db.execute(
-            "SELECT 1 FROM business_accounts WHERE account_id = ? AND is_active = 1 LIMIT 1;",
-            (business_account_id,),
-        )
-        if not await cur.fetchone():
+    async with transaction() as db:
+        # Ensure business is registered and staff account exists (one round-trip)
+        cur = await db.execute(_SQL_STAFF_TARGETS_OK, (business_account_id, staff_account_id))
+        biz_ok, staff_ok = await cur.fetchone()
+        if not biz_ok:
             raise ValueError("business account is not registered")
-
-        # Ensure staff account exists
-        cur = await db.execute(
-            "SELECT 1 FROM accounts WHERE id = ? AND is_active = 1 LIMIT 1;",
-            (staff_account_id,),
-        )
-        if not await cur.fetchone():
+        if not staff_ok:
             raise ValueError("staff account not found")
 
         cur = await db.execute(
-            """
-            INSERT INTO business_staff(
-                business_account_id, staff_name, staff_tg_id, staff_account_id,
-                monthly_salary, is_active, created_at
-            )
-            VALUES (?, ?, ?, ?, ?, 1, ?);
-            """,
+            _SQL_INSERT_STAFF,
             (
                 business_account_id,
                 staff_name,
                 staff_tg_id,
                 staff_account_id,
                 monthly_salary,
-                _utc_now_iso(),
             ),
         )
-        await db.commit()
-        return int(cur.lastrowid)
+    return int(cur.lastrowid)
 
 
 async def list_staff(admin_tg_id: int, business_account_id: int) -> List[tuple]:
     if not await is_admin(admin_tg_id):
         raise PermissionError("admin only")
 
-    await ensure_payroll_schema()
-
-    async with aiosqlite.connect(settings.DB_PATH) as db:
-        cur = await db.execute(
-            """
-            SELECT id, staff_name, staff_tg_id, staff_account_id, monthly_salary, is_active
-            FROM business_staff
-            WHERE business_account_id = ?
-            ORDER BY id ASC;
-            """,
-            (business_account_id,),
-        )
+    async with read_db() as db:
+        cur = await db.execute(_SQL_LIST_STAFF, (business_account_id,))
         return await cur.fetchall()
 
 
@@ -181,11 +168,11 @@ async def run_payroll(
     year: int,
     month: int,
     note: str,
-) -> List[tuple]:
+) -> List[Tuple[int, str]]:
     """
     Pays salaries from business account to staff accounts.
     Prevents duplicate run for same (business, year, month).
-    Returns list of (staff_id, receipt_no).
+    Returns list of (staff_id: int, receipt_no: str); callers use them as-is.
     """
     if not await is_admin(admin_tg_id):
         raise PermissionError("admin only")
@@ -197,50 +184,25 @@ async def run_payroll(
     if not note:
         note = f"Salary {year}-{month:02d}"
 
-    await ensure_payroll_schema()
-
-    async with aiosqlite.connect(settings.DB_PATH) as db:
-        await db.execute("PRAGMA foreign_keys=ON;")
-        await db.execute("BEGIN IMMEDIATE;")
-
+    # One transaction: duplicate guard, balances and ledger rows commit together.
+    async with transaction() as db:
         # Prevent duplicate month run
         try:
-            await db.execute(
-                """
-                INSERT INTO payroll_runs(business_account_id, year, month, created_by_tg_id, created_at)
-                VALUES (?, ?, ?, ?, ?);
-                """,
-                (business_account_id, year, month, admin_tg_id, _utc_now_iso()),
-            )
+            await db.execute(_SQL_INSERT_RUN, (business_account_id, year, month, admin_tg_id))
         except Exception:
-            await db.execute("ROLLBACK;")
             raise ValueError("payroll already executed for this business/month")
 
-        cur = await db.execute(
-            """
-            SELECT id, staff_name, staff_account_id, monthly_salary
-            FROM business_staff
-            WHERE business_account_id = ?
-              AND is_active = 1;
-            """,
-            (business_account_id,),
-        )
+        cur = await db.execute(_SQL_ACTIVE_STAFF, (business_account_id,))
         staff_rows = await cur.fetchall()
 
-        await db.commit()
-
-    # Execute transfers (each creates its own ledger row + receipt)
-    results: List[tuple] = []
-    for staff_id, staff_name, staff_account_id, salary in staff_rows:
-        desc = f"{note} | {staff_name}"
-        receipt_no, _png = await banking_transfer(
-            from_account_id=business_account_id,
-            to_account_id=int(staff_account_id),
-            amount=int(salary),
-            description=desc,
+        receipt_nos = await book_transfers(
+            db,
+            [
+                (business_account_id, int(staff_account_id), int(salary), f"{note} | {staff_name}")
+                for _staff_id, staff_name, staff_account_id, salary in staff_rows
+            ],
             created_by_tg_id=admin_tg_id,
             forced=False,
         )
-        results.append((int(staff_id), str(receipt_no)))
 
-    return results
+    return [(int(r[0]), receipt_no) for r, receipt_no in zip(staff_rows, receipt_nos)]
@@ -0,0 +1,25 @@
+from pydantic_settings import BaseSettings
+from pydantic import Field
+
+
+class Settings(BaseSettings):
+    BOT_TOKEN: str = Field(..., description="Telegram Bot Token")
+
+    # Database
+    DB_PATH: str = "data/bank.db"
+
+    # Receipt
+    RECEIPT_FONT: str = "assets/font.ttf"
+    RECEIPT_WIDTH: int = 900
+    RECEIPT_HEIGHT: int = 500
+
+    # Webhook (polling stays the default for local/dev runs)
+    USE_WEBHOOK: bool = False
+    WEBHOOK_BASE_URL: str = ""  # public https origin Telegram pushes to
+    WEBHOOK_SECRET: str = ""  # path segment + X-Telegram-Bot-Api-Secret-Token
+    WEBAPP_HOST: str = "0.0.0.0"
+    WEBAPP_PORT: int = 8080
+
+    class Config:
+        env_file = ".env"
+        env_file_encoding = "utf-8"
@@ -0,0 +1,39 @@
+"""
+Freezes the current settings (.env + environment) into app/_env_frozen.py.
+
+Run once per deploy:  python -m scripts.freeze_env
+app.config imports the frozen module when present and skips .env parsing;
+environment variables still override the snapshot.
+Re-run (or delete app/_env_frozen.py) whenever .env changes.
+"""
+from __future__ import annotations
+
+import logging
+import sys
+from pathlib import Path
+from pprint import pformat
+
+# Anchored at the repo root, not the cwd: app.config imports exactly this file.
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))  # also runnable as a plain script path
+
+# app.settings, not app.config: importing the latter builds settings from the cwd's .env
+from app.settings import Settings  # noqa: E402
+
+logger = logging.getLogger(__name__)
+ENV_PATH = ROOT_DIR / ".env"
+OUT_PATH = ROOT_DIR / "app" / "_env_frozen.py"
+
+
+def main() -> None:
+    values = Settings(_env_file=ENV_PATH).model_dump()
+    with open(OUT_PATH, "w", encoding="utf-8") as f:
+        f.write("# Generated by scripts/freeze_env.py. Do not edit or commit.\n")
+        f.write(f"SETTINGS = {pformat(values)}\n")
+    logger.info("Wrote %s", OUT_PATH)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    main()
@@ -0,0 +1,61 @@
+import asyncio
+import os
+
+import pytest
+
+os.environ.setdefault("BOT_TOKEN", "0:test")  # app.config requires one; tests never call the API
+
+from app import admin, db  # noqa: E402
+from app.banking import transfer  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.payroll import ensure_payroll_schema  # noqa: E402
+
+
+@pytest.fixture
+def run(tmp_path, monkeypatch):
+    """
+    run(coro, init=True): runs coro on a fresh event loop against a new DB file in
+    tmp_path (schema created first unless init=False), then closes the connections.
+    """
+    monkeypatch.setattr(settings, "DB_PATH", str(tmp_path / "bank.db"))
+    # module state must not leak between tests (asyncio locks bind to one loop)
+    monkeypatch.setattr(db, "_open_lock", asyncio.Lock())
+    monkeypatch.setattr(db, "_write_lock", asyncio.Lock())
+    monkeypatch.setattr(admin, "_owner_loaded", False)
+    monkeypatch.setattr(admin, "_owner_cache", None)
+    monkeypatch.setattr(admin, "_admins_cache", None)
+    monkeypatch.setattr(admin, "_main_pool_id", None)
+
+    def _run(coro, init=True):
+        async def _main():
+            try:
+                if init:
+                    await db.init_db()
+                    await ensure_payroll_schema()
+                return await coro
+            finally:
+                await db.close_db()
+
+        return asyncio.run(_main())
+
+    return _run
+
+
+@pytest.fixture
+def fund():
+    """
+    await fund(account_id, amount): forced MAIN POOL -> account transfer.
+    """
+
+    async def _fund(account_id: int, amount: int) -> None:
+        pool_id = await admin.get_main_pool_account_id()
+        await transfer(
+            from_account_id=pool_id,
+            to_account_id=account_id,
+            amount=amount,
+            description="seed",
+            created_by_tg_id=0,
+            forced=True,
+        )
+
+    return _fund
@@ -0,0 +1,44 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from app import admin
+from app.admin import add_admin, is_admin, remove_admin
+
+
+def _pause_first_load(monkeypatch):
+    """
+    Holds the first _load_access after its SELECT, before it publishes the cache.
+    Returns (loaded, release) events.
+    """
+    loaded, release = asyncio.Event(), asyncio.Event()
+    real_read_db = admin.read_db
+
+    @asynccontextmanager
+    async def paused_read_db():
+        async with real_read_db() as db:
+            yield db
+        if not loaded.is_set():
+            loaded.set()
+            await release.wait()
+
+    monkeypatch.setattr(admin, "read_db", paused_read_db)
+    return loaded, release
+
+
+@pytest.mark.parametrize("granted_before, change, granted_after", [(True, remove_admin, False), (False, add_admin, True)])
+def test_admin_change_during_cache_load_is_not_lost(run, monkeypatch, granted_before, change, granted_after):
+    async def body():
+        if granted_before:
+            await add_admin(42)
+        loaded, release = _pause_first_load(monkeypatch)
+
+        check = asyncio.create_task(is_admin(42))  # cold cache: loads the pre-change rows
+        await loaded.wait()
+        await change(42)
+        release.set()
+
+        return await check, await is_admin(42)
+
+    assert run(body()) == (granted_after, granted_after)
@@ -0,0 +1,205 @@
+import threading
+import time
+
+import pytest
+
+from app import banking
+from app.banking import _SQL_LAST_TX, book_transfers, get_balance, get_last_7_days, transfer
+from app.db import create_account, read_db, transaction
+
+
+async def _two_accounts(fund, amount):
+    """
+    Alice (tg 1, funded with amount) and Bob (tg 2, empty).
+    """
+    alice = await create_account(1, "personal", "Alice")
+    bob = await create_account(2, "personal", "Bob")
+    await fund(alice, amount)
+    return alice, bob
+
+
+async def _ledger_size():
+    async with read_db() as db:
+        cur = await db.execute("SELECT COUNT(*) FROM transactions;")
+        (n,) = await cur.fetchone()
+    return n
+
+
+def test_transfer_moves_funds(run, fund):
+    async def body():
+        alice, bob = await _two_accounts(fund, 100)
+
+        receipt_no, image, receiver_owner = await transfer(
+            from_account_id=alice,
+            to_account_id=bob,
+            amount=40,
+            description="rent",
+            created_by_tg_id=1,
+        )
+
+        assert receiver_owner == 2
+        assert image
+        assert await get_balance(alice) == 60
+        assert await get_balance(bob) == 40
+        assert [r.receipt_no for r in await get_last_7_days(bob)] == [receipt_no]
+
+    run(body())
+
+
+def test_transfer_insufficient_funds_changes_nothing(run, fund):
+    async def body():
+        alice, bob = await _two_accounts(fund, 30)
+        ledger = await _ledger_size()
+
+        with pytest.raises(ValueError, match="insufficient funds"):
+            await transfer(
+                from_account_id=alice,
+                to_account_id=bob,
+                amount=31,
+                description="too much",
+                created_by_tg_id=1,
+            )
+
+        assert await get_balance(alice) == 30
+        assert await get_balance(bob) == 0
+        assert await _ledger_size() == ledger
+
+    run(body())
+
+
+def test_self_transfer_keeps_balance_and_lists_once(run, fund):
+    async def body():
+        alice, _bob = await _two_accounts(fund, 50)
+
+        receipt_no, _image, receiver_owner = await transfer(
+            from_account_id=alice,
+            to_account_id=alice,
+            amount=20,
+            description="to myself",
+            created_by_tg_id=1,
+        )
+
+        assert receiver_owner == 1
+        assert await get_balance(alice) == 50
+        history = [r.receipt_no for r in await get_last_7_days(alice)]
+        assert history.count(receipt_no) == 1
+
+    run(body())
+
+
+def test_transfer_missing_receiver(run, fund):
+    async def body():
+        alice, _bob = await _two_accounts(fund, 50)
+        ledger = await _ledger_size()
+
+        with pytest.raises(ValueError, match="receiver account not found"):
+            await transfer(
+                from_account_id=alice,
+                to_account_id=9999,
+                amount=10,
+                description="nobody",
+                created_by_tg_id=1,
+            )
+
+        assert await get_balance(alice) == 50
+        assert await _ledger_size() == ledger
+
+    run(body())
+
+
+def test_book_transfers_books_every_item(run, fund):
+    async def body():
+        alice, bob = await _two_accounts(fund, 100)
+
+        async with transaction() as db:
+            receipt_nos = await book_transfers(
+                db,
+                [(alice, bob, 30, "one"), (alice, bob, 20, "two"), (alice, alice, 10, "self")],
+                created_by_tg_id=1,
+            )
+
+        assert len(set(receipt_nos)) == 3
+        assert await get_balance(alice) == 50
+        assert await get_balance(bob) == 50
+
+    run(body())
+
+
+def test_book_transfers_short_item_rolls_back_batch(run, fund):
+    async def body():
+        alice, bob = await _two_accounts(fund, 50)
+        ledger = await _ledger_size()
+
+        # each item is affordable on its own, the second one not after the first
+        with pytest.raises(ValueError, match="insufficient funds"):
+            async with transaction() as db:
+                await book_transfers(db, [(alice, bob, 30, "one"), (alice, bob, 30, "two")], created_by_tg_id=1)
+
+        assert await get_balance(alice) == 50
+        assert await get_balance(bob) == 0
+        assert await _ledger_size() == ledger
+
+    run(body())
+
+
+def test_history_window_order_and_limit(run):
+    async def body():
+        alice = await create_account(1, "personal", "Alice")
+        bob = await create_account(2, "personal", "Bob")
+        now = int(time.time())
+        async with transaction() as db:
+            await db.executemany(
+                """
+                INSERT INTO transactions(receipt_no, ts_utc, ts_epoch, from_account_id, to_account_id,
+                                         amount, status, description, created_by_tg_id, forced)
+                VALUES (?, '', ?, ?, ?, 1, 'SUCCESS', '', 0, 0);
+                """,
+                [
+                    ("old", now - 8 * 24 * 3600, alice, bob),
+                    ("in", now - 100, bob, alice),
+                    ("out", now - 50, alice, bob),
+                    ("self", now - 10, alice, alice),
+                ],
+            )
+
+        assert [r.receipt_no for r in await get_last_7_days(alice)] == ["self", "out", "in"]
+        assert [r.receipt_no for r in await get_last_7_days(alice, limit=2)] == ["self", "out"]
+
+    run(body())
+
+
+def test_history_reads_transactions_through_indexes_only(run):
+    async def body():
+        async with read_db() as db:
+            rows = await db.execute_fetchall(
+                "EXPLAIN QUERY PLAN " + _SQL_LAST_TX, {"acc": 1, "cutoff": 0, "limit": 30}
+            )
+        return [r[3] for r in rows]
+
+    plan = run(body())
+
+    assert any("COVERING INDEX idx_tx_from_ts" in d for d in plan)
+    assert any("COVERING INDEX idx_tx_to_cover" in d for d in plan)
+    assert not [d for d in plan if d.startswith(("SCAN transactions", "SCAN t"))]
+
+
+def test_transfer_renders_receipt_off_the_event_loop(run, fund, monkeypatch):
+    threads = []
+
+    def fake_render(**fields):
+        threads.append(threading.current_thread())
+        return b"image"
+
+    async def body():
+        alice, bob = await _two_accounts(fund, 100)
+        threads.clear()  # the seeding transfer rendered too
+        _, image, _ = await transfer(
+            from_account_id=alice, to_account_id=bob, amount=10, description="x", created_by_tg_id=1
+        )
+        return image
+
+    monkeypatch.setattr(banking, "render_receipt", fake_render)
+
+    assert run(body()) == b"image"
+    assert threads and threading.main_thread() not in threads
+
@@ -0,0 +1,46 @@
+import importlib
+import logging
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from app import config
+
+
+@pytest.fixture
+def frozen(monkeypatch):
+    """
+    Reloads app.config against a fake app/_env_frozen.py; the original settings object is put back afterwards.
+    """
+    original = config.settings
+
+    def _load(**values):
+        monkeypatch.setitem(sys.modules, "app._env_frozen", SimpleNamespace(SETTINGS=values))
+        return importlib.reload(config).settings
+
+    yield _load
+    config.settings = original
+
+
+def test_frozen_snapshot_is_used_and_logged(frozen, monkeypatch, caplog):
+    monkeypatch.delenv("BOT_TOKEN", raising=False)
+    monkeypatch.delenv("DB_PATH", raising=False)
+
+    with caplog.at_level(logging.WARNING, logger="app.config"):
+        s = frozen(BOT_TOKEN="1:frozen", DB_PATH="frozen.db", WEBAPP_PORT=9000)
+
+    assert (s.BOT_TOKEN, s.DB_PATH, s.WEBAPP_PORT) == ("1:frozen", "frozen.db", 9000)
+    assert "frozen settings" in caplog.text
+
+
+def test_environment_overrides_frozen_snapshot(frozen, monkeypatch, caplog):
+    monkeypatch.setenv("BOT_TOKEN", "2:rotated")
+    monkeypatch.setenv("WEBAPP_PORT", "8443")
+
+    with caplog.at_level(logging.WARNING, logger="app.config"):
+        s = frozen(BOT_TOKEN="1:frozen", WEBAPP_PORT=9000)
+
+    assert (s.BOT_TOKEN, s.WEBAPP_PORT) == ("2:rotated", 8443)  # validated, not just copied
+    assert "BOT_TOKEN, WEBAPP_PORT" in caplog.text
+    assert "2:rotated" not in caplog.text
@@ -0,0 +1,129 @@
+import calendar
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+from app.config import settings
+from app.db import create_account, get_db, init_db, read_db, transaction
+
+# Schema as created by the original init_db(): no accounts.balance, no
+# transactions.ts_epoch, single-column indexes.
+BASELINE_SCHEMA = """
+CREATE TABLE owners (
+    tg_user_id INTEGER PRIMARY KEY,
+    active_account_id INTEGER,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE accounts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner_tg_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    label TEXT NOT NULL,
+    is_active INTEGER NOT NULL DEFAULT 1,
+    created_at TEXT NOT NULL,
+    FOREIGN KEY (owner_tg_id) REFERENCES owners(tg_user_id) ON DELETE CASCADE
+);
+CREATE INDEX idx_accounts_owner ON accounts(owner_tg_id);
+CREATE INDEX idx_accounts_owner_kind ON accounts(owner_tg_id, kind);
+CREATE TABLE admins (
+    tg_user_id INTEGER PRIMARY KEY,
+    is_active INTEGER NOT NULL DEFAULT 1,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    receipt_no TEXT NOT NULL UNIQUE,
+    ts_utc TEXT NOT NULL,
+    from_account_id INTEGER,
+    to_account_id INTEGER,
+    amount INTEGER NOT NULL CHECK(amount > 0),
+    status TEXT NOT NULL,
+    description TEXT,
+    created_by_tg_id INTEGER NOT NULL,
+    forced INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (from_account_id) REFERENCES accounts(id) ON DELETE SET NULL,
+    FOREIGN KEY (to_account_id) REFERENCES accounts(id) ON DELETE SET NULL
+);
+CREATE INDEX idx_tx_ts ON transactions(ts_utc);
+CREATE INDEX idx_tx_from ON transactions(from_account_id);
+CREATE INDEX idx_tx_to ON transactions(to_account_id);
+"""
+
+TS = "2024-01-02T03:04:05+00:00"
+
+
+def _seed_baseline(path: str) -> None:
+    with closing(sqlite3.connect(path)) as conn, conn:
+        conn.executescript(BASELINE_SCHEMA)
+        conn.executemany(
+            "INSERT INTO owners(tg_user_id, active_account_id, created_at) VALUES (?, ?, ?);",
+            [(1, 1, TS), (2, 2, TS)],
+        )
+        conn.executemany(
+            "INSERT INTO accounts(id, owner_tg_id, kind, label, created_at) VALUES (?, ?, 'personal', ?, ?);",
+            [(1, 1, "Alice", TS), (2, 2, "Bob", TS)],
+        )
+        conn.executemany(
+            """
+            INSERT INTO transactions(receipt_no, ts_utc, from_account_id, to_account_id,
+                                     amount, status, description, created_by_tg_id, forced)
+            VALUES (?, ?, ?, ?, ?, ?, '', 0, 0);
+            """,
+            [
+                ("r1", TS, None, 1, 100, "FORCED"),
+                ("r2", TS, 1, 2, 30, "SUCCESS"),
+                ("r3", TS, 1, 2, 500, "FAILED"),  # never moved money
+            ],
+        )
+
+
+def test_init_db_upgrades_baseline_schema(run):
+    _seed_baseline(settings.DB_PATH)
+
+    async def body():
+        await init_db()
+        await init_db()  # idempotent on the upgraded file
+
+        async with read_db() as db:
+            balances = dict(await db.execute_fetchall("SELECT id, balance FROM accounts;"))
+            epochs = dict(await db.execute_fetchall("SELECT receipt_no, ts_epoch FROM transactions;"))
+            indexes = {r[0] for r in await db.execute_fetchall("SELECT name FROM sqlite_master WHERE type = 'index';")}
+            tables = {r[0] for r in await db.execute_fetchall("SELECT name FROM sqlite_master WHERE type = 'table';")}
+
+        assert balances == {1: 70, 2: 30}
+        assert set(epochs.values()) == {calendar.timegm((2024, 1, 2, 3, 4, 5))}
+        assert {"idx_tx_ts_epoch", "idx_tx_from_ts", "idx_tx_to_cover", "idx_accounts_owner_kind"} <= indexes
+        assert not {"idx_tx_ts", "idx_tx_from", "idx_tx_to", "idx_accounts_owner"} & indexes
+        assert "meta" in tables
+
+    run(body(), init=False)
+
+
+def test_writes_share_one_persistent_connection(run):
+    async def body():
+        conn = await get_db()
+        await create_account(1, "personal", "Alice")
+        async with transaction() as db:
+            assert db is conn
+        assert await get_db() is conn
+
+    run(body())
+
+
+def test_read_pool_is_read_only_and_sees_only_commits(run):
+    async def body():
+        await create_account(1, "personal", "Alice")
+        labels = "SELECT label FROM accounts;"
+
+        async with read_db() as reader:
+            with pytest.raises(sqlite3.OperationalError):
+                await reader.execute("DELETE FROM accounts;")
+
+            async with transaction() as db:
+                await db.execute("UPDATE accounts SET label = 'Changed';")
+                assert list(await reader.execute_fetchall(labels)) == [("Alice",)]
+
+            assert list(await reader.execute_fetchall(labels)) == [("Changed",)]
+
+    run(body())
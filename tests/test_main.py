@@ -0,0 +1,264 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from app import main
+from app.admin import ensure_owner_seed
+from app.banking import TxRow, transfer
+from app.db import Account, create_account, read_db, write_fetchall
+from app.payroll import add_staff, register_business_account
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_photo(self, **kwargs):
+        self.sent.append(kwargs)
+
+
+class FakeMessage:
+    """
+    The Message surface the handlers use: from_user.id, answer(), answer_photo(), bot.
+    """
+
+    def __init__(self, user_id: int):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.bot = FakeBot()
+        self.answers = []
+        self.photos = []
+
+    async def answer(self, text, **kwargs):
+        self.answers.append(text)
+
+    async def answer_photo(self, photo, **kwargs):
+        self.photos.append(photo)
+        return SimpleNamespace(photo=[SimpleNamespace(file_id="thumb"), SimpleNamespace(file_id="FILE_ID")])
+
+
+def _command(args):
+    return SimpleNamespace(args=args)
+
+
+def _sender(monkeypatch, transfer_result=("R1", b"png", 2)):
+    """
+    Alice (tg 1) as the active account; banking.transfer replaced by a recorder.
+    """
+    calls = []
+
+    async def fake_transfer(**kwargs):
+        calls.append(kwargs)
+        return transfer_result
+
+    async def fake_active(user_id):
+        return Account(10, user_id, "personal", "Alice", 1, "")
+
+    monkeypatch.setattr(main, "banking_transfer", fake_transfer)
+    monkeypatch.setattr(main, "get_active_account", fake_active)
+    return calls
+
+
+def test_transfer_handler_resends_receipt_by_file_id(monkeypatch):
+    _sender(monkeypatch)
+    msg = FakeMessage(1)
+
+    asyncio.run(main.transfer_handler(msg, _command("11 40 rent")))
+
+    assert len(msg.photos) == 1  # the only upload
+    assert [(s["chat_id"], s["photo"]) for s in msg.bot.sent] == [(2, "FILE_ID")]
+
+
+def test_transfer_handler_rejects_malformed_args(monkeypatch):
+    calls = _sender(monkeypatch)
+
+    for args in (None, "", "abc 40 rent", "11 -5 rent", "11 40", "11 rent"):
+        msg = FakeMessage(1)
+        asyncio.run(main.transfer_handler(msg, _command(args)))
+        assert msg.answers == ["Usage: /transfer <to_account_id> <amount> <desc>"], args
+
+    assert calls == []
+
+
+def test_transfer_handler_parses_args_once(monkeypatch):
+    calls = _sender(monkeypatch)
+
+    asyncio.run(main.transfer_handler(FakeMessage(1), _command("11 40 monthly\nrent")))
+
+    assert [(c["from_account_id"], c["to_account_id"], c["amount"], c["description"]) for c in calls] == [
+        (10, 11, 40, "monthly\nrent")
+    ]
+
+
+def test_show_history_formats_in_and_out_rows(monkeypatch):
+    rows = [
+        TxRow("R2", "", 10, 11, 1500, "SUCCESS", "", 1, 0),
+        TxRow("R1", "", None, 10, 20000, "FORCED", "", 0, 1),
+    ]
+
+    async def fake_active(user_id):
+        return Account(10, user_id, "personal", "Alice", 1, "")
+
+    async def fake_history(account_id, limit=50):
+        return rows
+
+    monkeypatch.setattr(main, "get_active_account", fake_active)
+    monkeypatch.setattr(main, "get_last_7_days", fake_history)
+    msg = FakeMessage(1)
+
+    asyncio.run(main.show_history(1, msg))
+
+    assert msg.answers == [
+        "Last 7 days history for Alice (personal) [ID:10]:\n"
+        "OUT | 1,500 SOLEN | SUCCESS | other:11 | #R2\n"
+        "IN | 20,000 SOLEN | FORCED | other:None | #R1"
+    ]
+
+
+def test_every_command_is_registered_with_command_filter():
+    dp = main.build_dispatcher()
+
+    routers = [dp, *dp.sub_routers]
+    handlers = [h for r in routers for h in r.message.handlers]
+
+    assert handlers
+    for handler in handlers:
+        assert any(isinstance(f.callback, main.Command) for f in handler.filters or ()), handler.callback
+
+
+def test_fetch_receipt_rows_joins_both_account_labels(run, fund):
+    async def body():
+        alice = await create_account(1, "personal", "Alice")
+        bob = await create_account(2, "business", "Shop")
+        await fund(alice, 100)
+        receipt_no, _, _ = await transfer(
+            from_account_id=alice, to_account_id=bob, amount=40, description="rent", created_by_tg_id=1
+        )
+        async with read_db() as db:
+            rows = await main._fetch_receipt_rows(db, [receipt_no, "missing"])
+        return alice, bob, receipt_no, rows
+
+    alice, bob, receipt_no, rows = run(body())
+
+    assert list(rows) == [receipt_no]
+    from_id, to_id, amount, status, desc, ts_epoch, *labels = rows[receipt_no]
+    assert (from_id, to_id, amount, status, desc) == (alice, bob, 40, "SUCCESS", "rent")
+    assert isinstance(ts_epoch, int)
+    assert labels == ["Alice", "personal", "Shop", "business"]
+
+
+class SlowBot:
+    """
+    send_photo that takes a while and records how many sends overlap.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.chats = []
+
+    async def send_photo(self, chat_id, photo, caption):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.02)
+        self.in_flight -= 1
+        self.chats.append(chat_id)
+
+
+def test_payroll_delivers_receipts_concurrently(run, fund, monkeypatch):
+    admin_tg_id = 1000
+    staff_tg_ids = [2001, 2002, 2003, 2004, 2005, 2006]
+    monkeypatch.setattr(main, "_payroll_pacer", main._SendPacer(global_rate=1e6, chat_rate=1e6))
+
+    async def body():
+        await ensure_owner_seed(admin_tg_id)
+        biz = await create_account(admin_tg_id, "business", "Shop")
+        await register_business_account(admin_tg_id, biz)
+        for tg_id in staff_tg_ids:
+            acc = await create_account(tg_id, "personal", f"Staff {tg_id}")
+            staff_id = await add_staff(admin_tg_id, biz, f"Staff {tg_id}", acc, 10)
+            await write_fetchall(main._SQL_STAFF_SET_TG, (tg_id, staff_id))
+        await fund(biz, 100)
+
+        msg = FakeMessage(admin_tg_id)
+        msg.bot = SlowBot()
+        await main.payroll_run_handler(msg, _command(f"{biz} 2024 5 May"))
+        return msg
+
+    msg = run(body())
+
+    assert sorted(msg.bot.chats) == staff_tg_ids
+    assert 1 < msg.bot.max_in_flight <= main._PAYROLL_SEND_CONCURRENCY
+    assert "Sent to staff: 6" in msg.answers[-1]
+
+
+RECEIPT_ROW = (1, 2, 40, "SUCCESS", "rent", 1700000000, "Alice", "personal", "Bob", "personal")
+
+
+def test_regenerated_receipts_are_cached_by_receipt_no(monkeypatch):
+    rendered = []
+
+    def fake_render(**fields):
+        rendered.append(fields["receipt_no"])
+        return f"image-{fields['receipt_no']}".encode()
+
+    monkeypatch.setattr(main, "render_receipt", fake_render)
+    monkeypatch.setattr(main, "_receipt_image_cache", OrderedDict())
+    monkeypatch.setattr(main, "_RECEIPT_CACHE_SIZE", 2)
+
+    async def body():
+        first = await main._regen_receipt_image("R1", RECEIPT_ROW)
+        assert await main._regen_receipt_image("R1", RECEIPT_ROW) is first
+        await main._regen_receipt_image("R2", RECEIPT_ROW)
+        await main._regen_receipt_image("R1", RECEIPT_ROW)  # refreshes R1
+        await main._regen_receipt_image("R3", RECEIPT_ROW)  # evicts R2, the oldest
+
+    asyncio.run(body())
+
+    assert rendered == ["R1", "R2", "R3"]
+    assert list(main._receipt_image_cache) == ["R1", "R3"]
+
+
+def test_regenerated_receipts_render_off_the_event_loop(monkeypatch):
+    threads = []
+
+    def fake_render(**fields):
+        threads.append(threading.current_thread())
+        return b"image"
+
+    monkeypatch.setattr(main, "render_receipt", fake_render)
+    monkeypatch.setattr(main, "_receipt_image_cache", OrderedDict())
+
+    assert asyncio.run(main._regen_receipt_image("R1", RECEIPT_ROW)) == b"image"
+    assert threads and threading.main_thread() not in threads
+
+
+def test_staff_link_and_unlink(run):
+    admin_tg_id = 1000
+
+    async def body():
+        await ensure_owner_seed(admin_tg_id)
+        biz = await create_account(admin_tg_id, "business", "Shop")
+        await register_business_account(admin_tg_id, biz)
+        acc = await create_account(2001, "personal", "Staff")
+        staff_id = await add_staff(admin_tg_id, biz, "Staff", acc, 10)
+
+        replies = []
+        for handler, args in (
+            (main.staff_link_handler, f"{staff_id} 2001"),
+            (main.staff_link_handler, "9999 2001"),
+            (main.staff_unlink_handler, f"{staff_id}"),
+        ):
+            msg = FakeMessage(admin_tg_id)
+            await handler(msg, _command(args))
+            replies.append(msg.answers)
+            async with read_db() as db:
+                rows = await db.execute_fetchall("SELECT staff_tg_id FROM business_staff;")
+            replies.append([tg_id for (tg_id,) in rows])
+        return replies
+
+    assert run(body()) == [
+        ["Staff TG ID linked."], [2001],
+        ["Staff not found."], [2001],
+        ["Staff TG ID unlinked."], [None],
+    ]
@@ -0,0 +1,110 @@
+import aiosqlite
+import pytest
+
+from app.admin import ensure_owner_seed
+from app.banking import get_balance
+from app.db import create_account, read_db
+from app.payroll import add_staff, register_business_account, run_payroll
+
+ADMIN_TG_ID = 1000
+
+
+async def _business(fund, salaries, funds):
+    """
+    Registered business account (funded with `funds`) with one staff member per salary.
+    """
+    await ensure_owner_seed(ADMIN_TG_ID)
+    biz = await create_account(ADMIN_TG_ID, "business", "Shop")
+    await register_business_account(ADMIN_TG_ID, biz)
+
+    staff_accounts = []
+    for i, salary in enumerate(salaries, start=1):
+        acc = await create_account(2000 + i, "personal", f"Staff {i}")
+        await add_staff(ADMIN_TG_ID, biz, f"Staff {i}", acc, salary)
+        staff_accounts.append(acc)
+
+    await fund(biz, funds)
+    return biz, staff_accounts
+
+
+async def _payroll_runs(biz):
+    async with read_db() as db:
+        cur = await db.execute("SELECT COUNT(*) FROM payroll_runs WHERE business_account_id = ?;", (biz,))
+        (n,) = await cur.fetchone()
+    return n
+
+
+def test_run_payroll_pays_every_staff(run, fund):
+    async def body():
+        biz, staff = await _business(fund, [100, 70], funds=200)
+
+        results = await run_payroll(ADMIN_TG_ID, biz, 2024, 5, "")
+
+        assert len(results) == 2
+        assert all(isinstance(staff_id, int) for staff_id, _ in results)
+        assert await get_balance(biz) == 30
+        assert [await get_balance(acc) for acc in staff] == [100, 70]
+
+    run(body())
+
+
+def test_run_payroll_rejects_duplicate_month(run, fund):
+    async def body():
+        biz, staff = await _business(fund, [100], funds=300)
+        await run_payroll(ADMIN_TG_ID, biz, 2024, 5, "")
+
+        with pytest.raises(ValueError, match="already executed"):
+            await run_payroll(ADMIN_TG_ID, biz, 2024, 5, "")
+
+        assert await get_balance(biz) == 200
+        assert await get_balance(staff[0]) == 100
+        assert await _payroll_runs(biz) == 1
+
+    run(body())
+
+
+def test_run_payroll_rolls_back_when_funds_run_out(run, fund):
+    async def body():
+        biz, staff = await _business(fund, [100, 100], funds=150)
+
+        with pytest.raises(ValueError, match="insufficient funds"):
+            await run_payroll(ADMIN_TG_ID, biz, 2024, 5, "")
+
+        # all-or-nothing: nobody paid, and the month is not marked as done
+        assert await get_balance(biz) == 150
+        assert [await get_balance(acc) for acc in staff] == [0, 0]
+        assert await _payroll_runs(biz) == 0
+
+        await fund(biz, 50)
+        assert len(await run_payroll(ADMIN_TG_ID, biz, 2024, 5, "")) == 2
+
+    run(body())
+
+
+def test_run_payroll_statements_do_not_depend_on_staff_count(run, fund, monkeypatch):
+    statements = []
+    for name in ("execute", "executemany"):
+
+        async def recorded(self, sql, *args, _orig=getattr(aiosqlite.Connection, name)):
+            statements.append(" ".join(sql.split()))
+            return await _orig(self, sql, *args)
+
+        monkeypatch.setattr(aiosqlite.Connection, name, recorded)
+
+    async def body():
+        biz, _ = await _business(fund, [10], funds=1000)
+        runs = []
+        for month in (5, 6):
+            statements.clear()
+            await run_payroll(ADMIN_TG_ID, biz, 2024, month, "")
+            runs.append(list(statements))
+
+            for i in range(4):
+                acc = await create_account(3000 + i, "personal", f"Extra {i}")
+                await add_staff(ADMIN_TG_ID, biz, f"Extra {i}", acc, 10)
+        return runs
+
+    one_staff, five_staff = run(body())
+
+    # same statement texts (so the same cached compiled statements), same count
+    assert one_staff == five_staff
@@ -0,0 +1,34 @@
+from io import BytesIO
+
+from PIL import Image
+
+from app.receipt.generator import HEIGHT, WIDTH, encode_receipt, generate_receipt, render_receipt
+
+FIELDS = dict(
+    sender_account="Alice (personal) [ID:1]",
+    receiver_account="Bob (personal) [ID:2]",
+    amount=1500,
+    status="SUCCESS",
+    description="rent",
+    receipt_no="1700000000000",
+)
+
+
+def test_encode_receipt_returns_palette_png_bytes():
+    _, image = generate_receipt(**FIELDS)
+
+    data = encode_receipt(image)
+
+    assert type(data) is bytes  # handed to BufferedInputFile as-is, no BytesIO round-trip
+    assert data[:8] == b"\x89PNG\r\n\x1a\n"
+    with Image.open(BytesIO(data)) as decoded:
+        assert (decoded.format, decoded.mode) == ("PNG", "P")
+        assert decoded.size == (WIDTH, HEIGHT)
+
+
+def test_render_receipt_returns_encoded_bytes():
+    data = render_receipt(**FIELDS)
+
+    assert type(data) is bytes
+    with Image.open(BytesIO(data)) as decoded:
+        assert decoded.size == (WIDTH, HEIGHT)